@@ -1,6 +1,29 @@
 import shutil
 import time
-from flask import Flask, render_template, request, jsonify, Response
+import hashlib
+import threading
+import sqlite3
+import functools
+import atexit
+import signal
+import sys
+import copy
+import queue
+import uuid
+import unicodedata
+import gzip
+import bisect
+import random
+import heapq
+import math
+import contextlib
+import contextvars
+import http.cookiejar
+import base64
+import mimetypes
+import zipfile
+import numpy as np
+from flask import Flask, render_template, request, jsonify, Response, g
 import requests
 from bs4 import BeautifulSoup
 import concurrent.futures
@@ -8,9 +31,12 @@ import re
 import json
 import os
 from datetime import datetime
-from urllib.parse import quote
-from collections import Counter
+from urllib.parse import quote, unquote_to_bytes, urljoin, urlsplit
+from collections import Counter, OrderedDict, deque
+from requests.adapters import HTTPAdapter
+from werkzeug.datastructures import ETags
 from werkzeug.utils import secure_filename
+from markupsafe import escape
 
 app = Flask(__name__)
 app.config['APP_NAME'] = 'L8teSearch'
@@ -22,67 +48,1268 @@ os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 DATA_FOLDER = 'data'
 os.makedirs(DATA_FOLDER, exist_ok=True)
 PROJECTS_FILE = os.path.join(DATA_FOLDER, 'projects.json')
+PROJECTS_DB = os.path.join(DATA_FOLDER, 'projects.db')
+
+# --- Metrics ---
+# Timing spans around the hot paths (fetch, parse, extract, match, highlight,
+# load, save), per-route latency histograms and cache hit/miss counters, kept
+# in process and exposed in Prometheus text format on /metrics. Spans also
+# collect into the current request's Server-Timing header; fetch engine jobs
+# run in a copy of the submitting request's context so their spans count too.
+
+app.config['SERVER_TIMING'] = os.environ.get('SERVER_TIMING', '1') == '1'
+
+METRIC_PREFIX = 'l8te_'
+METRIC_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+METRIC_HELP = {
+    'request_duration_seconds': ('histogram', 'Time until the response headers, per route.'),
+    'span_duration_seconds': ('histogram', 'Time spent in instrumented code paths.'),
+    'requests_total': ('counter', 'Handled requests by route and status.'),
+    'cache_requests_total': ('counter', 'Cache lookups by cache and result.'),
+    'store_flushes_total': ('counter', 'Write transactions committed to the project store.'),
+    'store_rows_written_total': ('counter', 'Rows written or deleted by store flushes.'),
+    'fetch_retries_total': ('counter', 'Fetch attempts repeated after a transient failure.'),
+    'fetch_rejected_total': ('counter', 'Fetches skipped because the host circuit was open.'),
+    'circuit_opened_total': ('counter', 'Host circuit breakers that opened.'),
+    'search_timeouts_total': ('counter', 'Search URLs given up on when the budget ran out.'),
+}
+
+metrics_lock = threading.Lock()
+histograms = {}  # (name, labels) -> [count per bucket..., +Inf, sum, count]
+counters = Counter()
+request_timings = contextvars.ContextVar('request_timings', default=None)
+
+def metric_key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+def observe(name, seconds, **labels):
+    key = metric_key(name, labels)
+    with metrics_lock:
+        values = histograms.get(key)
+        if values is None:
+            values = histograms[key] = [0] * (len(METRIC_BUCKETS) + 3)
+        values[bisect.bisect_left(METRIC_BUCKETS, seconds)] += 1
+        values[-2] += seconds
+        values[-1] += 1
+
+def inc(name, amount=1, **labels):
+    with metrics_lock:
+        counters[metric_key(name, labels)] += amount
+
+@contextlib.contextmanager
+def span(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        observe('span_duration_seconds', elapsed, span=name)
+        timings = request_timings.get()
+        if timings is not None:
+            timings.append((name, elapsed))
+
+def format_labels(labels, **extra):
+    labels = list(labels) + list(extra.items())
+    if not labels:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in labels)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + '}'
+
+def render_metrics(gauges):
+    """Prometheus text exposition of all histograms, counters and the given gauges."""
+    with metrics_lock:
+        histogram_items = sorted((k, list(v)) for k, v in histograms.items())
+        counter_items = sorted(counters.items())
+
+    lines = []
+    described = set()
+    def describe(name, metric_type, help_text):
+        if name not in described:
+            described.add(name)
+            lines.append(f"# HELP {METRIC_PREFIX}{name} {help_text}")
+            lines.append(f"# TYPE {METRIC_PREFIX}{name} {metric_type}")
+
+    for (name, labels), values in histogram_items:
+        describe(name, *METRIC_HELP[name])
+        cumulative = 0
+        for bound, count in zip(METRIC_BUCKETS + ('+Inf',), values):
+            cumulative += count
+            lines.append(f"{METRIC_PREFIX}{name}_bucket{format_labels(labels, le=bound)} {cumulative}")
+        lines.append(f"{METRIC_PREFIX}{name}_sum{format_labels(labels)} {values[-2]:.6f}")
+        lines.append(f"{METRIC_PREFIX}{name}_count{format_labels(labels)} {values[-1]}")
+    for (name, labels), value in counter_items:
+        describe(name, *METRIC_HELP[name])
+        lines.append(f"{METRIC_PREFIX}{name}{format_labels(labels)} {value}")
+    for name, help_text, value in gauges:
+        describe(name, 'gauge', help_text)
+        lines.append(f"{METRIC_PREFIX}{name} {value}")
+    return '\n'.join(lines) + '\n'
+
+@app.before_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    request_timings.set([])
+
+@app.after_request
+def record_request_metrics(response):
+    elapsed = time.perf_counter() - g.get('request_started', time.perf_counter())
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    observe('request_duration_seconds', elapsed, route=route, method=request.method)
+    inc('requests_total', route=route, method=request.method, status=response.status_code)
+    if app.config['SERVER_TIMING']:
+        totals = OrderedDict()
+        for name, seconds in request_timings.get() or ():
+            totals[name] = totals.get(name, 0) + seconds
+        entries = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in totals.items()]
+        entries.append(f"total;dur={elapsed * 1000:.1f}")
+        response.headers['Server-Timing'] = ', '.join(entries)
+    return response
+
+# --- Background Workers ---
+# Long-running threads (store flusher, crawl refresh, image worker) are
+# registered at import time but only started by the first request. With
+# `python app.py` the Werkzeug reloader imports this module in a watcher
+# process that never serves anything; starting threads there would crawl
+# every URL twice and race the serving process on the page index files.
+
+background_workers = []  # (thread name, target)
+background_lock = threading.Lock()
+background_started = False
+
+@app.before_request
+def start_background_workers():
+    global background_started
+    if background_started:
+        return
+    with background_lock:
+        if not background_started:
+            for name, target in background_workers:
+                threading.Thread(target=target, name=name, daemon=True).start()
+            background_started = True
+
+# --- Change Feed ---
+# Committed changes are published by the flusher as compact per-project delta
+# events ({notes: [...upserted], deleted: [...ids], fields?, removed_fields?,
+# urls?}). fields only carries the top-level fields that changed; added and
+# removed URLs go out one by one as {op: 'url_added' | 'url_removed', url}
+# entries in urls, so adding a source does not resend the URL list and the
+# mindmap. A project's first delta carries all its fields. Each
+# /stream client holds a Subscription whose queue only receives events for its
+# project; recent events are kept in change_log so a reconnecting client can
+# resume from its Last-Event-ID instead of reloading everything. Event ids are
+# '<epoch>-<seq>' with a per-process epoch, so an id handed out before a
+# restart never matches the new sequence; such clients get a fresh snapshot.
+# Progress events (crawl state) are transient: they skip change_log and carry
+# no id.
+
+app.config['STREAM_HEARTBEAT'] = int(os.environ.get('STREAM_HEARTBEAT', 15))
+
+change_feed_lock = threading.Lock()
+change_log = deque(maxlen=1000)
+last_event_id = 0
+change_feed_epoch = uuid.uuid4().hex[:12]
+subscribers = set()
+
+class Subscription:
+    def __init__(self, project):
+        self.project = project
+        self.queue = queue.Queue()
+
+    def wants(self, project):
+        return self.project is None or self.project == project
+
+def publish_changes(events):
+    global last_event_id
+    with change_feed_lock:
+        for project, payload in events:
+            last_event_id += 1
+            event = (last_event_id, project, json.dumps(payload))
+            change_log.append(event)
+            for sub in subscribers:
+                if sub.wants(project):
+                    sub.queue.put(event)
+
+def publish_transient(project, payload):
+    """Pushes a progress event to live subscribers without logging it for resume."""
+    event = (None, project, json.dumps(payload))
+    with change_feed_lock:
+        for sub in subscribers:
+            if sub.wants(project):
+                sub.queue.put(event)
+
+def subscribe(project, last_id=None):
+    """Registers a subscriber.
+
+    Returns (subscription, replay, snapshot_id): replay lists the missed
+    events when last_id can be resumed from change_log, otherwise it is None
+    and the caller sends a snapshot tagged with snapshot_id.
+    """
+    sub = Subscription(project)
+    with change_feed_lock:
+        subscribers.add(sub)
+        replay = None
+        if last_id is not None and last_id <= last_event_id:
+            if last_id == last_event_id or (change_log and change_log[0][0] <= last_id + 1):
+                replay = [e for e in change_log if e[0] > last_id and sub.wants(e[1])]
+        return sub, replay, last_event_id
+
+def unsubscribe(sub):
+    with change_feed_lock:
+        subscribers.discard(sub)
+
+def format_event_id(seq):
+    return f"{change_feed_epoch}-{seq}"
+
+def parse_event_id(value):
+    """Returns the sequence number of an event id from this process, otherwise None."""
+    epoch, _, seq = (value or '').rpartition('-')
+    if epoch != change_feed_epoch or not seq.isdigit():
+        return None
+    return int(seq)
+
+# --- Storage ---
+# Projects live in SQLite (WAL mode): one row per project holding everything
+# except its notes, and one row per note. At startup they are read once into
+# projects_state, which serves every read from memory. Mutating routes run
+# under projects_lock, change projects_state in place, record what they
+# touched with mark_note_changed() / mark_fields_changed() and call
+# save_projects_to_disk(), which only bumps projects_generation and wakes the
+# write-behind flusher. The flusher coalesces bursts of writes: under the lock
+# it only copies the marked notes and projects, then serializes them, drops
+# rows that did not actually change and commits the rest in a single
+# transaction without holding the lock, so a flush costs O(changes).
+#
+# Notes carry a lexicographic `rank` and each project's list is kept sorted by
+# it, so moving a note only rewrites that note's row. note_indexes maps
+# project -> note id -> note for constant-time lookups; it is maintained by the
+# note helpers below and rebuilt whenever it turns out to be stale.
+
+app.config['STORE_FLUSH_DELAY'] = float(os.environ.get('STORE_FLUSH_DELAY', 0.5))
+
+projects_lock = threading.RLock()
+projects_generation = 0
+flushed_generation = 0  # generation that stored_projects reflects
+projects_state = {}
+projects_json_cache = (None, None)
+stored_projects = {}
+changed_notes = {}  # project -> ids of changed notes, None = all of them
+changed_fields = set()  # projects whose own fields (urls, mindmap, ...) changed
+note_indexes = {}
+note_search_indexes = {}  # see Note Search
+note_search_builds = {}
+store_dirty = threading.Event()
+flush_lock = threading.Lock()
+db_local = threading.local()
+
+def get_db():
+    conn = getattr(db_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(PROJECTS_DB, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=FULL')
+        db_local.conn = conn
+    return conn
+
+def with_projects_lock(f):
+    @functools.wraps(f)
+    def wrapper(*args, **kwargs):
+        with projects_lock:
+            return f(*args, **kwargs)
+    return wrapper
+
+def ensure_unique_note_ids(notes):
+    """Fixes missing or duplicate ids in place; returns True if any changed."""
+    seen = set()
+    changed = False
+    for note in notes:
+        note_id = str(note.get('id') or new_note_id())
+        base, n = note_id, 1
+        while note_id in seen:
+            note_id = f"{base}-{n}"
+            n += 1
+        seen.add(note_id)
+        if note.get('id') != note_id:
+            note['id'] = note_id
+            changed = True
+    return changed
+
+def new_note_id():
+    return uuid.uuid4().hex
+
+RANK_DIGITS = '0123456789abcdefghijklmnopqrstuvwxyz'
+RANK_WIDTH = 8
+
+def rank_after(rank):
+    """Rank for a note appended after `rank` (None for an empty list)."""
+    n = int(rank[:RANK_WIDTH], 36) + 1 if rank else 1
+    digits = ''
+    while n:
+        n, d = divmod(n, 36)
+        digits = RANK_DIGITS[d] + digits
+    return digits.rjust(RANK_WIDTH, '0')
+
+def rank_between(lo, hi):
+    """Shortest rank strictly between lo and hi ('' / None = unbounded)."""
+    lo = lo or ''
+    if hi is not None and lo >= hi:
+        raise ValueError(f"Cannot rank between {lo!r} and {hi!r}")
+    base = len(RANK_DIGITS)
+    rank = ''
+    i = 0
+    while True:
+        lo_digit = RANK_DIGITS.index(lo[i]) if i < len(lo) else 0
+        hi_digit = base if hi is None else (RANK_DIGITS.index(hi[i]) if i < len(hi) else 0)
+        if hi_digit - lo_digit > 1:
+            return rank + RANK_DIGITS[(lo_digit + hi_digit) // 2]
+        rank += RANK_DIGITS[lo_digit]
+        if hi_digit > lo_digit:
+            # Everything starting with `rank` is below hi from here on
+            hi = None
+        i += 1
+
+def ensure_note_ranks(notes):
+    """Gives notes without a rank, or out of order, a rank that fits the list."""
+    prev = None
+    for i, note in enumerate(notes):
+        rank = note.get('rank')
+        if not isinstance(rank, str) or (prev is not None and rank <= prev):
+            following = notes[i + 1].get('rank') if i + 1 < len(notes) else None
+            if isinstance(following, str) and following > (prev or ''):
+                note['rank'] = rank_between(prev, following)
+            else:
+                note['rank'] = rank_after(prev)
+        prev = note['rank']
+
+def rank_position(notes, rank):
+    """Index of the first note whose rank is not below `rank`."""
+    lo, hi = 0, len(notes)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if notes[mid]['rank'] < rank:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+def get_note_index(project_name):
+    index = note_indexes.get(project_name)
+    if index is None:
+        notes = projects_state[project_name].setdefault('notes', [])
+        index = note_indexes[project_name] = {note['id']: note for note in notes}
+    return index
+
+def find_note(project_name, note_id):
+    """Returns the live note dict, or None. Caller holds projects_lock."""
+    if project_name not in projects_state:
+        return None
+    note = get_note_index(project_name).get(note_id)
+    if note is not None and note.get('id') != note_id:
+        note_indexes.pop(project_name, None)
+        note = get_note_index(project_name).get(note_id)
+    return note
+
+def insert_note(project_name, note):
+    """Appends a note with a fresh id and rank. Caller holds projects_lock."""
+    notes = projects_state[project_name].setdefault('notes', [])
+    note['id'] = new_note_id()
+    note['rank'] = rank_after(notes[-1]['rank'] if notes else None)
+    notes.append(note)
+    get_note_index(project_name)[note['id']] = note
+    index_note(project_name, note)
+    mark_note_changed(project_name, note['id'])
+    return note
+
+def remove_note(project_name, note_id):
+    note = find_note(project_name, note_id)
+    if note is None:
+        return None
+    del projects_state[project_name]['notes'][note_position(project_name, note)]
+    del note_indexes[project_name][note_id]
+    unindex_note(project_name, note_id)
+    mark_note_changed(project_name, note_id)
+    return note
+
+def reposition_note(project_name, note_id, position):
+    """Moves a note to list index `position` by giving it a new rank."""
+    note = remove_note(project_name, note_id)
+    if note is None:
+        return None
+    notes = projects_state[project_name]['notes']
+    position = max(0, min(position, len(notes)))
+    lo = notes[position - 1]['rank'] if position > 0 else None
+    hi = notes[position]['rank'] if position < len(notes) else None
+    note['rank'] = rank_after(lo) if hi is None else rank_between(lo, hi)
+    notes.insert(position, note)
+    note_indexes[project_name][note_id] = note
+    index_note(project_name, note)
+    return note
+
+def note_position(project_name, note):
+    notes = projects_state[project_name]['notes']
+    i = rank_position(notes, note['rank'])
+    return i if i < len(notes) and notes[i] is note else notes.index(note)
 
 def load_projects_from_disk():
-    if os.path.exists(PROJECTS_FILE):
-        with open(PROJECTS_FILE, 'r') as f:
-            return json.load(f)
-    return {}
+    """Returns the live in-memory store.
+
+    Callers that change it must hold projects_lock and call
+    save_projects_to_disk() afterwards; read-only callers that iterate over
+    it should hold the lock too or use get_projects_json().
+    """
+    return projects_state
+
+def mark_note_changed(project_name, note_id):
+    """Queues a note row (added, edited, moved or removed) for the next flush."""
+    with projects_lock:
+        note_ids = changed_notes.setdefault(project_name, set())
+        if note_ids is not None:
+            note_ids.add(note_id)
+
+def mark_fields_changed(project_name):
+    """Queues a project's own row for the next flush."""
+    with projects_lock:
+        changed_fields.add(project_name)
+
+def mark_project_changed(project_name):
+    with projects_lock:
+        changed_fields.add(project_name)
+        changed_notes[project_name] = None
 
 def save_projects_to_disk(projects):
-    if os.path.exists(PROJECTS_FILE):
-        shutil.copy2(PROJECTS_FILE, PROJECTS_FILE + ".bak")
-    with open(PROJECTS_FILE, 'w') as f:
-        json.dump(projects, f, indent=4)
+    global projects_generation
+    with projects_lock:
+        if projects is not projects_state:
+            projects_state.clear()
+            projects_state.update(projects)
+            note_indexes.clear()
+            note_search_indexes.clear()
+            note_search_builds.clear()
+            for name, project in projects_state.items():
+                notes = project.setdefault('notes', [])
+                ensure_unique_note_ids(notes)
+                ensure_note_ranks(notes)
+                mark_project_changed(name)
+        projects_generation += 1
+    store_dirty.set()
+
+def get_projects_json():
+    """Serialized store, rebuilt at most once per generation."""
+    global projects_json_cache
+    generation, payload = projects_json_cache
+    if generation != projects_generation:
+        with projects_lock, span('load'):
+            generation = projects_generation
+            payload = json.dumps(projects_state, sort_keys=True)
+        projects_json_cache = (generation, payload)
+    return payload
+
+@span('load')
+def read_projects_from_db(conn):
+    projects = {}
+    for name, data in conn.execute('SELECT name, data FROM projects ORDER BY position'):
+        projects[name] = json.loads(data)
+        projects[name]['notes'] = []
+    for project, data in conn.execute('SELECT project, data FROM notes ORDER BY project, rank'):
+        if project in projects:
+            projects[project]['notes'].append(json.loads(data))
+    return projects
+
+def take_changes():
+    """Copies the projects and notes marked since the last flush and resets the marks.
+
+    Caller holds flush_lock and projects_lock; the copies are serialized
+    after the lock is released. Returns (deleted project
+    names, [(name, fields or None, {note id: note or None}, all_notes)]).
+    """
+    deleted = stored_projects.keys() - projects_state.keys()
+    changes = []
+    for name in [n for n in projects_state if n in changed_fields or n in changed_notes]:
+        project = projects_state[name]
+        fields = None
+        if name in changed_fields or name not in stored_projects:
+            fields = copy.deepcopy({k: v for k, v in project.items() if k != 'notes'})
+        note_ids = changed_notes.get(name, ())
+        if note_ids is None:
+            notes = {note['id']: copy.deepcopy(note) for note in project.get('notes', [])}
+        else:
+            notes = {note_id: copy.deepcopy(find_note(name, note_id)) for note_id in note_ids}
+        changes.append((name, fields, notes, note_ids is None))
+    changed_fields.clear()
+    changed_notes.clear()
+    return deleted, changes
+
+def field_changes(delta, old_fields, fields):
+    """Puts what changed between two versions of a project's fields into delta."""
+    changed = {k: v for k, v in fields.items() if k != 'urls' and old_fields.get(k) != v}
+    removed = [k for k in old_fields if k not in fields]
+    old_urls = old_fields.get('urls', [])
+    new_urls = fields.get('urls')
+    if 'urls' in fields and new_urls != old_urls:
+        added = dropped = None
+        if all(isinstance(urls, list) and all(isinstance(u, str) for u in urls) for urls in (old_urls, new_urls)):
+            old_set, new_set = set(old_urls), set(new_urls)
+            added = [u for u in new_urls if u not in old_set]
+            dropped = [u for u in old_urls if u not in new_set]
+        # Single changes unless the list was reordered or replaced wholesale
+        if (added is not None and len(added) + len(dropped) <= len(new_urls)
+                and [u for u in old_urls if u in new_set] + added == new_urls):
+            delta['urls'] = ([{'op': 'url_removed', 'url': u} for u in dropped] +
+                             [{'op': 'url_added', 'url': u} for u in added])
+        else:
+            changed['urls'] = new_urls
+    if changed:
+        delta['fields'] = changed
+    if removed:
+        delta['removed_fields'] = removed
+
+def diff_project_rows(ops, deltas, name, position, fields, notes, all_notes, old):
+    """Rows to write for one changed project; returns its new stored_projects entry."""
+    delta = {'type': 'delta', 'project': name, 'notes': [], 'deleted': []}
+    entry = {'data': old['data'] if old else None, 'position': position,
+             'notes': dict(old['notes']) if old else {}}
+    if fields is not None:
+        data = json.dumps(fields)
+        if data != entry['data']:
+            ops.append(('INSERT OR REPLACE INTO projects (name, position, data) VALUES (?, ?, ?)',
+                        (name, position, data)))
+            if entry['data'] is None:
+                delta['fields'] = fields
+            else:
+                field_changes(delta, json.loads(entry['data']), fields)
+            entry['data'] = data
+
+    stored_notes = entry['notes']
+    removed = stored_notes.keys() - notes.keys() if all_notes else ()
+    for note_id, note in notes.items():
+        if note is None:
+            continue
+        row = json.dumps(note)
+        if stored_notes.get(note_id) != row:
+            ops.append(('INSERT OR REPLACE INTO notes (project, id, rank, data) VALUES (?, ?, ?, ?)',
+                        (name, note_id, note['rank'], row)))
+            delta['notes'].append(note)
+            stored_notes[note_id] = row
+    for note_id in sorted(removed) + [i for i, note in notes.items() if note is None]:
+        if stored_notes.pop(note_id, None) is not None:
+            ops.append(('DELETE FROM notes WHERE project = ? AND id = ?', (name, note_id)))
+            delta['deleted'].append(note_id)
 
-def search_in_url(url, keywords):
+    if any(k in delta for k in ('fields', 'removed_fields', 'urls')) or delta['notes'] or delta['deleted']:
+        deltas.append((name, delta))
+    return entry
+
+def flush_projects():
+    """Writes the marked changes of projects_state to SQLite in one transaction."""
+    global flushed_generation
+    with flush_lock:
+        with projects_lock:
+            generation = projects_generation
+            if generation == flushed_generation:
+                return
+            deleted, changes = take_changes()
+        try:
+            ops = []
+            deltas = []
+            for name in deleted:
+                ops.append(('DELETE FROM notes WHERE project = ?', (name,)))
+                ops.append(('DELETE FROM projects WHERE name = ?', (name,)))
+                deltas.append((name, {'type': 'project_deleted', 'project': name}))
+            next_position = max((e['position'] for e in stored_projects.values()), default=-1) + 1
+            new_state = {}
+            for name, fields, notes, all_notes in changes:
+                old = stored_projects.get(name)
+                if old and not all_notes:
+                    position = old['position']
+                else:  # new or recreated, so last in projects_state
+                    position, next_position = next_position, next_position + 1
+                new_state[name] = diff_project_rows(ops, deltas, name, position, fields, notes, all_notes, old)
+            if ops:
+                conn = get_db()
+                with span('save'):
+                    conn.execute('BEGIN IMMEDIATE')
+                    try:
+                        for sql, params in ops:
+                            conn.execute(sql, params)
+                        conn.execute('COMMIT')
+                    except BaseException:
+                        conn.execute('ROLLBACK')
+                        raise
+                inc('store_flushes_total')
+                inc('store_rows_written_total', len(ops))
+        except BaseException:
+            # Nothing was committed: queue the same projects again in full
+            with projects_lock:
+                for name, *_ in changes:
+                    if name in projects_state:
+                        mark_project_changed(name)
+            raise
+        for name in deleted:
+            del stored_projects[name]
+        stored_projects.update(new_state)
+        flushed_generation = generation
+        publish_changes(deltas)
+
+def project_flusher():
+    while True:
+        store_dirty.wait()
+        time.sleep(app.config['STORE_FLUSH_DELAY'])
+        store_dirty.clear()
+        try:
+            flush_projects()
+        except Exception as e:
+            print(f"Flushing projects failed: {e}")
+            store_dirty.set()
+
+def init_storage():
+    conn = get_db()
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS projects (
+            name TEXT PRIMARY KEY,
+            position INTEGER NOT NULL,
+            data TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS notes (
+            project TEXT NOT NULL,
+            id TEXT NOT NULL,
+            rank TEXT NOT NULL,
+            data TEXT NOT NULL,
+            PRIMARY KEY (project, id)
+        );
+    """)
+    conn.execute('CREATE INDEX IF NOT EXISTS notes_by_rank ON notes (project, rank)')
+
+    for name, position, data in conn.execute('SELECT name, position, data FROM projects'):
+        stored_projects[name] = {'data': data, 'position': position, 'notes': {}}
+    for project, note_id, data in conn.execute('SELECT project, id, data FROM notes'):
+        if project in stored_projects:
+            stored_projects[project]['notes'][note_id] = data
+    projects_state.update(read_projects_from_db(conn))
+
+    # One-shot migration from the old whole-file storage
+    if not stored_projects and os.path.exists(PROJECTS_FILE):
+        with open(PROJECTS_FILE, 'r') as f:
+            projects = json.load(f)
+        for project in projects.values():
+            project.setdefault('notes', [])
+        save_projects_to_disk(projects)
+        flush_projects()
+        os.replace(PROJECTS_FILE, PROJECTS_FILE + '.migrated')
+        print(f"Migrated {len(projects)} projects from {PROJECTS_FILE} to {PROJECTS_DB}")
+
+    background_workers.append(('project-flusher', project_flusher))
+    atexit.register(flush_projects)
+
+init_storage()
+
+# --- Fetch Engine ---
+# One process-wide pool for all outgoing page fetches. A shared requests
+# session keeps connections alive per host (so DNS lookups and TLS handshakes
+# are reused), FETCH_WORKERS caps the global concurrency and FETCH_PER_HOST
+# caps how many workers a single host may hold, so one slow site queues behind
+# itself instead of starving everything else. The session shares one cookie
+# jar across every host and project, so it is set to refuse all cookies:
+# nothing a site sets is sent back on later fetches or ends up in the cache.
+# The background crawler (see Crawl Scheduler) has its own CRAWL_WORKERS but
+# fetches through the same session, so the connection pool holds enough
+# connections for both engines' workers.
+
+app.config['FETCH_WORKERS'] = int(os.environ.get('FETCH_WORKERS', 16))
+app.config['FETCH_PER_HOST'] = int(os.environ.get('FETCH_PER_HOST', 4))
+app.config['CRAWL_WORKERS'] = int(os.environ.get('CRAWL_WORKERS', 2))
+
+http_session = requests.Session()
+http_session.cookies.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+http_adapter = HTTPAdapter(pool_connections=64, pool_block=False,
+                           pool_maxsize=app.config['FETCH_WORKERS'] + app.config['CRAWL_WORKERS'])
+http_session.mount('http://', http_adapter)
+http_session.mount('https://', http_adapter)
+
+def url_host(url):
+    return urlsplit(url if '://' in url else 'https://' + url).netloc.lower()
+
+class FetchEngine:
+    def __init__(self, workers, per_host):
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='fetch')
+        self.per_host = per_host
+        self.lock = threading.Lock()
+        self.active = Counter()
+        self.waiting = {}
+
+    def submit(self, url, fn, *args):
+        """Runs fn(*args) on the pool once url's host has a free slot."""
+        future = concurrent.futures.Future()
+        fn = functools.partial(contextvars.copy_context().run, fn)
+        host = url_host(url)
+        with self.lock:
+            if self.active[host] < self.per_host:
+                self.active[host] += 1
+            else:
+                self.waiting.setdefault(host, deque()).append((future, fn, args))
+                return future
+        self.executor.submit(self._run, host, future, fn, args)
+        return future
+
+    def _run(self, host, future, fn, args):
+        while True:
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(fn(*args))
+                except BaseException as e:
+                    future.set_exception(e)
+            # Hand the host slot straight to the next queued job for the same host
+            with self.lock:
+                queue = self.waiting.get(host)
+                if not queue:
+                    self.waiting.pop(host, None)
+                    self.active[host] -= 1
+                    if not self.active[host]:
+                        del self.active[host]
+                    return
+                future, fn, args = queue.popleft()
+
+fetch_engine = FetchEngine(app.config['FETCH_WORKERS'], app.config['FETCH_PER_HOST'])
+
+# --- Fetch Resilience ---
+# Every outgoing GET goes through request_page: transient failures
+# (connection errors, timeouts, 429/502/503/504) are retried up to
+# FETCH_RETRIES times with full-jitter exponential backoff or the server's
+# Retry-After, and never past the caller's deadline. A per-host circuit
+# breaker opens after CIRCUIT_FAILURES consecutive failures and rejects that
+# host without a request for CIRCUIT_COOLDOWN seconds; then a single trial
+# request decides whether it closes again. /search runs under an overall
+# budget (SEARCH_BUDGET, or the request's own 'budget' up to
+# SEARCH_MAX_BUDGET); URLs without an answer by then come back as 'timeout'.
+
+app.config['FETCH_CONNECT_TIMEOUT'] = float(os.environ.get('FETCH_CONNECT_TIMEOUT', 5))
+app.config['FETCH_MAX_SECONDS'] = float(os.environ.get('FETCH_MAX_SECONDS', 30))
+app.config['FETCH_RETRIES'] = int(os.environ.get('FETCH_RETRIES', 2))
+app.config['FETCH_BACKOFF'] = float(os.environ.get('FETCH_BACKOFF', 0.5))
+app.config['CIRCUIT_FAILURES'] = int(os.environ.get('CIRCUIT_FAILURES', 5))
+app.config['CIRCUIT_COOLDOWN'] = float(os.environ.get('CIRCUIT_COOLDOWN', 60))
+app.config['SEARCH_BUDGET'] = float(os.environ.get('SEARCH_BUDGET', 15))
+app.config['SEARCH_MAX_BUDGET'] = float(os.environ.get('SEARCH_MAX_BUDGET', 60))
+
+HOST_DOWN_STATUSES = {502, 503, 504}
+RETRY_STATUSES = HOST_DOWN_STATUSES | {429}
+
+class FetchTimeout(requests.Timeout):
+    pass
+
+class HostUnavailable(requests.ConnectionError):
+    pass
+
+class CircuitBreaker:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if self.probing or time.time() - self.opened_at < app.config['CIRCUIT_COOLDOWN']:
+                return False
+            self.probing = True
+            return True
+
+    def record(self, ok):
+        with self.lock:
+            self.probing = False
+            if ok:
+                self.failures = 0
+                self.opened_at = None
+                return
+            self.failures += 1
+            if self.opened_at is not None or self.failures >= app.config['CIRCUIT_FAILURES']:
+                if self.opened_at is None:
+                    inc('circuit_opened_total')
+                self.opened_at = time.time()
+
+    def release(self):
+        """Ends a trial request whose outcome says nothing about the host."""
+        with self.lock:
+            self.probing = False
+
+circuit_breakers_lock = threading.Lock()
+circuit_breakers = {}
+
+def get_circuit_breaker(host):
+    with circuit_breakers_lock:
+        breaker = circuit_breakers.get(host)
+        if breaker is None:
+            breaker = circuit_breakers[host] = CircuitBreaker()
+        return breaker
+
+def retry_delay(attempt, retry_after=None):
+    if retry_after and retry_after.strip().isdigit():
+        return float(retry_after)
+    return random.uniform(0, app.config['FETCH_BACKOFF'] * 2 ** attempt)
+
+def request_page(url, headers, timeout, deadline=None):
+    """Streamed GET with retries, guarded by the host's circuit breaker.
+
+    Each attempt's timeout is cut to what is left until deadline (default
+    FETCH_MAX_SECONDS from now). A response with a retryable status is
+    returned as is once retries or time run out, so callers still see it.
+    """
+    deadline = deadline or time.time() + app.config['FETCH_MAX_SECONDS']
+    host = url_host(url)
+    breaker = get_circuit_breaker(host)
+    attempt = 0
+    while True:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            raise FetchTimeout(f"No time left to fetch {url}")
+        if not breaker.allow():
+            inc('fetch_rejected_total')
+            raise HostUnavailable(f"{host} is not responding, skipped for now")
+        read_timeout = min(timeout, remaining)
+        try:
+            response = http_session.get(url, headers=headers, allow_redirects=True, stream=True,
+                                        timeout=(min(app.config['FETCH_CONNECT_TIMEOUT'], read_timeout), read_timeout))
+        except (requests.ConnectionError, requests.Timeout):
+            breaker.record(False)
+            delay = retry_delay(attempt)
+            if attempt >= app.config['FETCH_RETRIES'] or time.time() + delay >= deadline:
+                raise
+        except BaseException:
+            breaker.release()
+            raise
+        else:
+            breaker.record(response.status_code not in HOST_DOWN_STATUSES)
+            if response.status_code not in RETRY_STATUSES:
+                return response
+            delay = retry_delay(attempt, response.headers.get('Retry-After'))
+            if attempt >= app.config['FETCH_RETRIES'] or time.time() + delay >= deadline:
+                return response
+            response.close()
+        inc('fetch_retries_total')
+        time.sleep(delay)
+        attempt += 1
+
+# --- Page Cache ---
+# Fetched pages are stored content-addressed (blob name = sha256 of the body)
+# under DATA_FOLDER, with a small JSON index mapping each requested URL to its
+# blob, final URL, headers and validators. Entries are kept in LRU order and
+# evicted once the blobs exceed PAGE_CACHE_MAX_BYTES; blob reference counts
+# and the total size are kept up to date, so a store costs O(1) and not a
+# pass over the index. The index file is rewritten by a background thread at
+# most every PAGE_CACHE_SAVE_INTERVAL seconds (and at exit) once it changed.
+
+PAGE_CACHE_FOLDER = os.path.join(DATA_FOLDER, 'page_cache')
+os.makedirs(PAGE_CACHE_FOLDER, exist_ok=True)
+PAGE_CACHE_INDEX = os.path.join(PAGE_CACHE_FOLDER, 'index.json')
+app.config['PAGE_CACHE_TTL'] = int(os.environ.get('PAGE_CACHE_TTL', 3600))
+app.config['PAGE_CACHE_MAX_BYTES'] = int(os.environ.get('PAGE_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+app.config['FETCH_MAX_BYTES'] = int(os.environ.get('FETCH_MAX_BYTES', 10 * 1024 * 1024))
+app.config['PAGE_CACHE_SAVE_INTERVAL'] = float(os.environ.get('PAGE_CACHE_SAVE_INTERVAL', 5))
+
+page_cache_lock = threading.Lock()
+page_cache_save_lock = threading.Lock()
+page_cache_dirty = False
+
+class PageTooLarge(Exception):
+    pass
+
+class CachedPage:
+    def __init__(self, url, headers, content, encoding, digest, from_cache=False):
+        self.url = url
+        self.headers = headers
+        self.content = content
+        self.encoding = encoding
+        self.digest = digest
+        self.from_cache = from_cache
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding or 'utf-8', errors='replace')
+
+def load_page_cache_index():
+    if os.path.exists(PAGE_CACHE_INDEX):
+        try:
+            with open(PAGE_CACHE_INDEX, 'r') as f:
+                return OrderedDict((e['key'], e) for e in json.load(f))
+        except (OSError, ValueError, KeyError):
+            pass
+    return OrderedDict()
+
+page_cache_index = load_page_cache_index()
+page_blob_refs = Counter(e['body'] for e in page_cache_index.values())
+page_cache_bytes = sum({e['body']: e['size'] for e in page_cache_index.values()}.values())
+
+def save_page_cache_index():
+    """Writes the index file if it changed since the last save."""
+    global page_cache_dirty
+    with page_cache_save_lock:
+        with page_cache_lock:
+            if not page_cache_dirty:
+                return
+            entries = list(page_cache_index.values())
+            page_cache_dirty = False
+        tmp_file = PAGE_CACHE_INDEX + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(entries, f)
+        os.replace(tmp_file, PAGE_CACHE_INDEX)
+
+def page_cache_saver():
+    while True:
+        time.sleep(app.config['PAGE_CACHE_SAVE_INTERVAL'])
+        try:
+            save_page_cache_index()
+        except OSError as e:
+            print(f"Saving the page cache index failed: {e}")
+
+background_workers.append(('page-cache-saver', page_cache_saver))
+atexit.register(save_page_cache_index)
+
+def mark_page_cache_dirty():
+    global page_cache_dirty
+    page_cache_dirty = True
+
+def page_blob_path(digest):
+    return os.path.join(PAGE_CACHE_FOLDER, digest[:2], digest)
+
+def read_page_blob(digest):
     try:
-        if not url.startswith(('http://', 'https://')):
-            url = 'https://' + url
-        
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
-        }
-        
-        response = requests.get(url, headers=headers, timeout=10)
-        response.raise_for_status()
-        
-        soup = BeautifulSoup(response.text, 'html.parser')
-        
+        with open(page_blob_path(digest), 'rb') as f:
+            return f.read()
+    except OSError:
+        return None
+
+def write_page_blob(digest, content):
+    path = page_blob_path(digest)
+    if os.path.exists(path):
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_file = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_file, 'wb') as f:
+        f.write(content)
+    os.replace(tmp_file, path)
+
+# Blobs can be shared by several URLs, so only sizes of distinct blobs count
+# and a blob is removed with its last entry. Callers hold page_cache_lock.
+
+def ref_page_blob(entry):
+    global page_cache_bytes
+    page_blob_refs[entry['body']] += 1
+    if page_blob_refs[entry['body']] == 1:
+        page_cache_bytes += entry['size']
+
+def unref_page_blob(entry):
+    global page_cache_bytes
+    page_blob_refs[entry['body']] -= 1
+    if page_blob_refs[entry['body']] <= 0:
+        del page_blob_refs[entry['body']]
+        page_cache_bytes -= entry['size']
+        try:
+            os.remove(page_blob_path(entry['body']))
+        except OSError:
+            pass
+
+def evict_page_cache():
+    max_bytes = app.config['PAGE_CACHE_MAX_BYTES']
+    while page_cache_bytes > max_bytes and page_cache_index:
+        _, entry = page_cache_index.popitem(last=False)
+        unref_page_blob(entry)
+
+def iter_body(response, max_bytes, deadline=None):
+    declared = response.headers.get('Content-Length')
+    if declared and declared.isdigit() and int(declared) > max_bytes:
+        raise PageTooLarge(f"Page is larger than {max_bytes} bytes")
+    size = 0
+    for chunk in response.iter_content(64 * 1024):
+        size += len(chunk)
+        if size > max_bytes:
+            raise PageTooLarge(f"Page is larger than {max_bytes} bytes")
+        if deadline and time.time() > deadline:
+            raise FetchTimeout(f"Page took too long to download ({size} bytes so far)")
+        yield chunk
+
+def read_body(response, max_bytes, deadline=None):
+    return b''.join(iter_body(response, max_bytes, deadline))
+
+def store_cached_page(key, response, content):
+    digest = hashlib.sha256(content).hexdigest()
+    write_page_blob(digest, content)
+    entry = {
+        'key': key,
+        'url': response.url,
+        'body': digest,
+        'size': len(content),
+        'encoding': response.encoding or requests.compat.chardet.detect(content)['encoding'],
+        'headers': {k: v for k, v in response.headers.items()
+                    if k.lower() in ('content-type', 'etag', 'last-modified')},
+        'fetched_at': time.time()
+    }
+    with page_cache_lock:
+        ref_page_blob(entry)
+        old = page_cache_index.pop(key, None)
+        if old:
+            unref_page_blob(old)
+        page_cache_index[key] = entry
+        evict_page_cache()
+        mark_page_cache_dirty()
+    return CachedPage(entry['url'], entry['headers'], content, entry['encoding'], digest)
+
+def fetch_page(url, headers, timeout, max_bytes=None, deadline=None):
+    """Fetches a page through the on-disk cache.
+
+    Fresh entries (younger than PAGE_CACHE_TTL) are served from disk; stale
+    ones are revalidated with If-None-Match / If-Modified-Since so unchanged
+    pages cost a 304 instead of a full download. Bodies above max_bytes
+    (default FETCH_MAX_BYTES) raise PageTooLarge without being read in full.
+    If the host fails or times out, a stale entry is served rather than nothing.
+    """
+    max_bytes = max_bytes or app.config['FETCH_MAX_BYTES']
+    with page_cache_lock:
+        entry = page_cache_index.get(url)
+        if entry:
+            page_cache_index.move_to_end(url)
+
+    if entry and entry['size'] > max_bytes:
+        raise PageTooLarge(f"Page is larger than {max_bytes} bytes")
+    content = read_page_blob(entry['body']) if entry else None
+    if content is None:
+        entry = None
+
+    request_headers = dict(headers)
+    if entry:
+        if time.time() - entry['fetched_at'] < app.config['PAGE_CACHE_TTL']:
+            inc('cache_requests_total', cache='page', result='hit')
+            return CachedPage(entry['url'], entry['headers'], content, entry['encoding'], entry['body'], from_cache=True)
+        cached_headers = {k.lower(): v for k, v in entry['headers'].items()}
+        if 'etag' in cached_headers:
+            request_headers['If-None-Match'] = cached_headers['etag']
+        if 'last-modified' in cached_headers:
+            request_headers['If-Modified-Since'] = cached_headers['last-modified']
+
+    deadline = deadline or time.time() + app.config['FETCH_MAX_SECONDS']
+    with span('fetch'):
+        try:
+            response = request_page(url, request_headers, timeout, deadline)
+        except requests.RequestException:
+            if not entry:
+                raise
+            response = None
+        with response or contextlib.nullcontext():
+            if entry and (response is None or response.status_code >= 500):
+                inc('cache_requests_total', cache='page', result='stale')
+                return CachedPage(entry['url'], entry['headers'], content, entry['encoding'], entry['body'], from_cache=True)
+            if entry and response.status_code == 304:
+                inc('cache_requests_total', cache='page', result='revalidated')
+                with page_cache_lock:
+                    entry['fetched_at'] = time.time()
+                    mark_page_cache_dirty()
+                return CachedPage(entry['url'], entry['headers'], content, entry['encoding'], entry['body'], from_cache=True)
+
+            inc('cache_requests_total', cache='page', result='miss')
+            response.raise_for_status()
+            body = read_body(response, max_bytes, deadline)
+    return store_cached_page(url, response, body)
+
+def normalize_url(url):
+    if not url.startswith(('http://', 'https://')):
+        url = 'https://' + url
+    return url
+
+# --- HTML Parsing ---
+# Text extraction runs through one of several backends, picked by speed among
+# those installed: selectolax (Lexbor, C), BeautifulSoup on lxml (C) and
+# BeautifulSoup on the stdlib html.parser as the always-available fallback.
+# HTML_PARSER overrides the choice; benchmarks/bench_parsers.py compares them.
+
+try:
+    import lxml  # noqa: F401
+    BS4_PARSER = 'lxml'
+except ImportError:
+    BS4_PARSER = 'html.parser'
+
+try:
+    from selectolax.lexbor import LexborHTMLParser as SelectolaxParser
+except ImportError:
+    SelectolaxParser = None
+
+def parse_html(html):
+    return BeautifulSoup(html, BS4_PARSER)
+
+def normalize_text(text):
+    # Same chunks as splitlines() -> strip -> split("  ") -> strip, but as a
+    # single C-level split over the text instead of nested generators
+    return '\n'.join(filter(None, map(str.strip, '  '.join(text.splitlines()).split('  '))))
+
+def extract_text_bs4(html, parser):
+    with span('parse'):
+        soup = BeautifulSoup(html, parser)
+    
+    with span('extract'):
         for script in soup(["script", "style"]):
-            script.extract()
-            
-        text = soup.get_text()
+            script.decompose()
         
-        lines = (line.strip() for line in text.splitlines())
-        chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-        text = '\n'.join(chunk for chunk in chunks if chunk)
-        
-        results = []
-        for keyword in keywords:
-            matches = re.finditer(re.escape(keyword), text, re.IGNORECASE)
-            
-            snippets = []
-            for match in matches:
-                start = max(0, match.start() - 60)
-                end = min(len(text), match.end() + 60)
-                snippet = text[start:end].replace('\n', ' ')
-                snippets.append(f"...{snippet}...")
-                if len(snippets) >= 5:
-                    break
-            
-            if snippets:
-                results.append({
-                    'keyword': keyword,
-                    'count': len(list(re.finditer(re.escape(keyword), text, re.IGNORECASE))),
-                    'snippets': snippets
-                })
+        title = soup.title.string if soup.title else None
+        return (str(title) if title is not None else None), normalize_text(soup.get_text())
+
+def extract_text_selectolax(html):
+    with span('parse'):
+        tree = SelectolaxParser(html)
+    with span('extract'):
+        title = tree.css_first('title')
+        title = title.text() if title else None
+        tree.strip_tags(['script', 'style'])
+        return title, normalize_text(tree.root.text(separator='') if tree.root else '')
+
+TEXT_EXTRACTORS = {'html.parser': lambda html: extract_text_bs4(html, 'html.parser')}
+if BS4_PARSER == 'lxml':
+    TEXT_EXTRACTORS['lxml'] = lambda html: extract_text_bs4(html, 'lxml')
+if SelectolaxParser is not None:
+    TEXT_EXTRACTORS['selectolax'] = extract_text_selectolax
+
+app.config['HTML_PARSER'] = os.environ.get('HTML_PARSER') or next(
+    name for name in ('selectolax', 'lxml', 'html.parser') if name in TEXT_EXTRACTORS)
+
+def extract_page_text(html):
+    """Returns (title, cleaned text) using the configured parser backend."""
+    extractor = TEXT_EXTRACTORS.get(app.config['HTML_PARSER'], TEXT_EXTRACTORS['html.parser'])
+    return extractor(html)
+
+def make_snippet(text, start, end):
+    start = max(0, start - 60)
+    end = min(len(text), end + 60)
+    snippet = text[start:end].replace('\n', ' ')
+    return f"...{snippet}..."
+
+# Every Latin letter with diacritics in U+00C0-U+024F, grouped by its base letter
+DIACRITIC_VARIANTS = {}
+for code in range(0xC0, 0x250):
+    base = unicodedata.normalize('NFD', chr(code))[0].lower()
+    if base != chr(code).lower() and base.isascii() and base.isalpha():
+        DIACRITIC_VARIANTS.setdefault(base, set()).add(chr(code).lower())
+
+def strip_diacritics(text):
+    decomposed = unicodedata.normalize('NFD', text)
+    return ''.join(ch for ch in decomposed if not unicodedata.combining(ch)).replace('ß', 'ss')
+
+def keyword_pattern(keyword, fold_diacritics):
+    if not fold_diacritics:
+        return re.escape(keyword)
+    folded = strip_diacritics(keyword.lower())
+    parts = []
+    i = 0
+    while i < len(folded):
+        if folded.startswith('ss', i):
+            parts.append('(?:ss|ß)')
+            i += 2
+            continue
+        ch = folded[i]
+        if ch in DIACRITIC_VARIANTS:
+            variants = ''.join(sorted(DIACRITIC_VARIANTS[ch]))
+            # Also accept decomposed text (base letter followed by combining marks)
+            parts.append(f'[{ch}{variants}][\u0300-\u036f]*')
+        else:
+            parts.append(re.escape(ch))
+        i += 1
+    return ''.join(parts)
+
+def keywords_overlap(keywords):
+    """True if a match of one keyword can overlap a match of another one."""
+    for a in keywords:
+        for b in keywords:
+            if a == b:
+                continue
+            if b in a or any(a.endswith(b[:n]) for n in range(1, min(len(a), len(b)))):
+                return True
+    return False
+
+@functools.lru_cache(maxsize=256)
+def compile_keyword_matcher(keywords, whole_word=False, fold_diacritics=False):
+    """Compiles keywords into as few patterns as possible.
+
+    Returns a list of (pattern, spellings) pairs, where group k<i> of the
+    pattern matches every keyword in spellings[i]: keywords that only differ
+    in case (or in diacritics, when folding) match the same text, so they
+    share one alternative and each of them gets its hits. Normally there is
+    one alternation over all keywords, so the text is scanned once. Keywords
+    whose matches could overlap each other (e.g. 'lessing' and 'less') get a
+    pattern each, because a single leftmost scan would hide the shorter
+    match and under-count it.
+    """
+    groups = {}
+    for keyword in dict.fromkeys(keywords):
+        folded = strip_diacritics(keyword.lower()) if fold_diacritics else keyword.lower()
+        groups.setdefault(folded, []).append(keyword)
+    folded = list(groups)
+    spellings = list(groups.values())
+    boundary = (r'(?<!\w)', r'(?!\w)') if whole_word else ('', '')
+
+    if len(spellings) > 1 and not keywords_overlap(folded):
+        # Longest first so that equal-position alternatives prefer the longer keyword
+        ordered = sorted(range(len(spellings)), key=lambda i: -len(folded[i]))
+        alternation = '|'.join(f'(?P<k{i}>{keyword_pattern(spellings[i][0], fold_diacritics)})' for i in ordered)
+        pattern = re.compile(f'{boundary[0]}(?:{alternation}){boundary[1]}', re.IGNORECASE)
+        return [(pattern, spellings)]
+
+    matchers = []
+    for i, group in enumerate(spellings):
+        pattern = re.compile(f'{boundary[0]}(?P<k{i}>{keyword_pattern(group[0], fold_diacritics)}){boundary[1]}', re.IGNORECASE)
+        matchers.append((pattern, spellings))
+    return matchers
+
+@span('match')
+def find_keywords(text, keywords, whole_word=False, fold_diacritics=False):
+    counts = {}
+    snippets = {}
+    for pattern, spellings in compile_keyword_matcher(tuple(keywords), whole_word, fold_diacritics):
+        for match in pattern.finditer(text):
+            snippet = None
+            for keyword in spellings[int(match.lastgroup[1:])]:
+                counts[keyword] = counts.get(keyword, 0) + 1
+                found = snippets.setdefault(keyword, [])
+                if len(found) < 5:
+                    snippet = snippet or make_snippet(text, match.start(), match.end())
+                    found.append(snippet)
+
+    results = []
+    for keyword in keywords:
+        if keyword in counts:
+            results.append({
+                'keyword': keyword,
+                'count': counts[keyword],
+                'snippets': snippets[keyword]
+            })
+    return results
+
+def fetch_page_text(url, deadline=None):
+    headers = {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+    }
+    
+    response = fetch_page(url, headers, timeout=10, deadline=deadline)
+    title, text = extract_page_text(response.text)
+    return title, text
+
+def search_in_url(url, keywords, page_index=None, whole_word=False, fold_diacritics=False, deadline=None):
+    try:
+        url = normalize_url(url)
+        title, text = fetch_page_text(url, deadline)
+        if page_index is not None:
+            page_index.add_document(url, title, text)
         
         return {
             'url': url,
             'status': 'success',
-            'title': soup.title.string if soup.title else url,
-            'findings': results
+            'title': title if title is not None else url,
+            'findings': find_keywords(text, keywords, whole_word, fold_diacritics)
+        }
+    except requests.Timeout as e:
+        return {
+            'url': url,
+            'status': 'timeout',
+            'message': str(e)
         }
     except Exception as e:
         return {
@@ -91,6 +1318,900 @@ def search_in_url(url, keywords):
             'message': str(e)
         }
 
+# --- Page Index ---
+# Per-project inverted index over the cleaned page text produced by
+# extract_page_text. Postings map a lowercased word to {url: [char offsets]},
+# so /search can rebuild the same findings/count/snippets as search_in_url
+# without going to the network. Documents are persisted one file per URL under
+# data/page_index/<project hash>/ and the postings are rebuilt on first use.
+# Keywords match inside words, so the vocabulary is kept as a sorted list
+# (prefix matches are a bisect range) plus a map from the trigrams after a
+# term's first letter to the terms containing them (matches further in).
+# Only the project's own URLs are indexed.
+
+PAGE_INDEX_FOLDER = os.path.join(DATA_FOLDER, 'page_index')
+os.makedirs(PAGE_INDEX_FOLDER, exist_ok=True)
+WORD_RE = re.compile(r'\w+')
+
+def url_key(url):
+    return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+class PageIndex:
+    def __init__(self, folder):
+        self.folder = folder
+        self.lock = threading.Lock()
+        self.documents = {}
+        self.postings = {}
+        self.terms = None  # sorted vocabulary; built once after loading
+        self.infixes = {}  # trigram -> terms containing it after their first letter
+        self.dropped = False  # set when the project is deleted; no more writes
+        os.makedirs(folder, exist_ok=True)
+        for filename in os.listdir(folder):
+            if not filename.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(folder, filename), 'r') as f:
+                    doc = json.load(f)
+                self._index(doc)
+            except (OSError, ValueError, KeyError):
+                pass
+        self.terms = sorted(self.postings)
+
+    def _add_term(self, term):
+        if self.terms is not None:
+            bisect.insort(self.terms, term)
+        for i in range(1, len(term) - 2):
+            self.infixes.setdefault(term[i:i + 3], set()).add(term)
+
+    def _remove_term(self, term):
+        del self.terms[bisect.bisect_left(self.terms, term)]
+        for i in range(1, len(term) - 2):
+            terms = self.infixes.get(term[i:i + 3])
+            if terms is not None:
+                terms.discard(term)
+                if not terms:
+                    del self.infixes[term[i:i + 3]]
+
+    def _index(self, doc):
+        self.documents[doc['url']] = doc
+        for match in WORD_RE.finditer(doc['text']):
+            term = match.group().lower()
+            docs = self.postings.get(term)
+            if docs is None:
+                docs = self.postings[term] = {}
+                self._add_term(term)
+            docs.setdefault(doc['url'], []).append(match.start())
+
+    def _unindex(self, url):
+        doc = self.documents.pop(url, None)
+        if not doc:
+            return
+        for term in {m.group().lower() for m in WORD_RE.finditer(doc['text'])}:
+            docs = self.postings.get(term)
+            if docs:
+                docs.pop(url, None)
+                if not docs:
+                    del self.postings[term]
+                    self._remove_term(term)
+
+    def _terms_containing(self, needle):
+        terms = []
+        i = bisect.bisect_left(self.terms, needle)
+        while i < len(self.terms) and self.terms[i].startswith(needle):
+            terms.append(self.terms[i])
+            i += 1
+        if len(needle) < 3:
+            inner = self.terms  # too short for a trigram, check every term
+        else:
+            sets = sorted((self.infixes.get(needle[i:i + 3], ()) for i in range(len(needle) - 2)), key=len)
+            inner = sets[0] if len(sets) == 1 else set(sets[0]).intersection(*sets[1:])
+        terms.extend(t for t in inner if needle in t[1:] and not t.startswith(needle))
+        return terms
+
+    def has(self, url):
+        return url in self.documents
+
+    def is_stale(self, url, max_age):
+        doc = self.documents.get(url)
+        return doc is None or time.time() - doc['indexed_at'] > max_age
+
+    def add_document(self, url, title, text):
+        doc = {'url': url, 'title': title, 'text': text, 'indexed_at': time.time()}
+        with self.lock:
+            if self.dropped:
+                return
+            old = self.documents.get(url)
+            if old and old['text'] == text and old['title'] == title:
+                old['indexed_at'] = doc['indexed_at']
+                return
+            self._unindex(url)
+            self._index(doc)
+            tmp_file = os.path.join(self.folder, url_key(url) + '.tmp')
+            with open(tmp_file, 'w') as f:
+                json.dump(doc, f)
+            os.replace(tmp_file, os.path.join(self.folder, url_key(url) + '.json'))
+
+    def remove_document(self, url):
+        with self.lock:
+            self._unindex(url)
+            try:
+                os.remove(os.path.join(self.folder, url_key(url) + '.json'))
+            except OSError:
+                pass
+
+    def search(self, urls, keywords, whole_word=False, fold_diacritics=False):
+        """Returns {url: search_in_url-style result} for the indexed URLs among urls."""
+        with self.lock, span('match'):
+            terms = {}
+            for keyword in keywords:
+                needle = keyword.lower()
+                if WORD_RE.fullmatch(keyword) and len(needle) == len(keyword) and not (whole_word or fold_diacritics):
+                    terms[keyword] = [(t, self.postings[t]) for t in self._terms_containing(needle)]
+            # Phrases, punctuation and the whole-word/diacritic modes scan the stored text instead
+            scanned_keywords = [k for k in keywords if k not in terms]
+
+            results = {}
+            for url in urls:
+                doc = self.documents.get(url)
+                if not doc:
+                    continue
+                text = doc['text']
+                scanned = {}
+                if scanned_keywords:
+                    scanned = {f['keyword']: f for f in find_keywords(text, scanned_keywords, whole_word, fold_diacritics)}
+                findings = []
+                for keyword in keywords:
+                    if keyword not in terms:
+                        if keyword in scanned:
+                            findings.append(scanned[keyword])
+                        continue
+                    needle = keyword.lower()
+                    starts = []
+                    for term, docs in terms[keyword]:
+                        for offset in docs.get(url, ()):
+                            pos = term.find(needle)
+                            while pos != -1:
+                                starts.append(offset + pos)
+                                pos = term.find(needle, pos + len(needle))
+                    if starts:
+                        starts.sort()
+                        findings.append({
+                            'keyword': keyword,
+                            'count': len(starts),
+                            'snippets': [make_snippet(text, s, s + len(keyword)) for s in starts[:5]]
+                        })
+                results[url] = {
+                    'url': url,
+                    'status': 'success',
+                    'title': doc['title'] if doc['title'] is not None else url,
+                    'findings': findings
+                }
+            return results
+
+page_indexes = {}
+page_indexes_lock = threading.Lock()
+
+def get_page_index(project_name):
+    with page_indexes_lock:
+        if project_name not in page_indexes:
+            folder = os.path.join(PAGE_INDEX_FOLDER, url_key(project_name))
+            page_indexes[project_name] = PageIndex(folder)
+        return page_indexes[project_name]
+
+def drop_page_index(project_name):
+    with page_indexes_lock:
+        page_index = page_indexes.pop(project_name, None)
+        if page_index is not None:
+            # Waits for a write in progress; later ones are refused
+            with page_index.lock:
+                page_index.dropped = True
+        shutil.rmtree(os.path.join(PAGE_INDEX_FOLDER, url_key(project_name)), ignore_errors=True)
+
+def index_url(project_name, url):
+    url = normalize_url(url)
+    title, text = fetch_page_text(url)
+    page_index = get_page_index(project_name)
+    # The project may have been deleted while the job was queued or fetching;
+    # from here on drop_page_index marks this index as dropped
+    with projects_lock:
+        exists = project_name in projects_state
+    if not exists:
+        drop_page_index(project_name)
+        return
+    page_index.add_document(url, title, text)
+
+# --- Crawl Scheduler ---
+# Project URLs are fetched into the page cache and the page index in the
+# background, so searches and the proxy find them locally. URLs are queued
+# when they are added and whenever a search sees a stale copy; refresh_loop
+# also re-queues every stale or missing URL each CRAWL_INTERVAL seconds,
+# starting CRAWL_START_DELAY seconds after boot. Crawling runs on its own
+# small pool (CRAWL_WORKERS, one slot per host) so a long crawl queue never
+# sits in front of interactive /search and /proxy fetches. Per-URL state is
+# kept for /crawl/status, and progress goes out as transient 'crawl' events on
+# the live stream. Jobs of a project deleted while they were queued write
+# nothing.
+
+app.config['CRAWL_INTERVAL'] = int(os.environ.get('CRAWL_INTERVAL', 600))
+app.config['CRAWL_START_DELAY'] = int(os.environ.get('CRAWL_START_DELAY', 30))
+
+class CrawlScheduler:
+    def __init__(self, engine):
+        self.engine = engine
+        self.lock = threading.Lock()
+        self.urls = {}  # project -> url -> {'state', 'updated_at', 'error'?}
+
+    def enqueue(self, project_name, urls):
+        queued = []
+        with self.lock:
+            states = self.urls.setdefault(project_name, {})
+            for url in urls:
+                url = normalize_url(url)
+                if states.get(url, {}).get('state') in ('queued', 'running'):
+                    continue
+                states[url] = {'state': 'queued', 'updated_at': time.time()}
+                queued.append(url)
+        for url in queued:
+            self.engine.submit(url, self._crawl, project_name, url)
+        if queued:
+            self._publish(project_name)
+
+    def _set_state(self, project_name, url, state, error=None):
+        with self.lock:
+            states = self.urls.get(project_name)
+            if states is None:
+                return False  # project was deleted meanwhile
+            states[url] = {'state': state, 'updated_at': time.time()}
+            if error:
+                states[url]['error'] = error
+        return True
+
+    def _crawl(self, project_name, url):
+        if not self._set_state(project_name, url, 'running'):
+            return
+        try:
+            index_url(project_name, url)
+            self._set_state(project_name, url, 'done')
+        except Exception as e:
+            print(f"Indexing {url} failed: {e}")
+            self._set_state(project_name, url, 'failed', str(e))
+        self._publish(project_name, url)
+
+    def progress(self, project_name):
+        with self.lock:
+            counts = Counter(s['state'] for s in self.urls.get(project_name, {}).values())
+        return {state: counts[state] for state in ('queued', 'running', 'done', 'failed')}
+
+    def status(self, project_name):
+        with self.lock:
+            urls = copy.deepcopy(self.urls.get(project_name, {}))
+        return {'project': project_name, **self.progress(project_name), 'urls': urls}
+
+    def _publish(self, project_name, url=None):
+        event = {'type': 'crawl', 'project': project_name, **self.progress(project_name)}
+        if url:
+            with self.lock:
+                event['url'] = url
+                event['state'] = self.urls.get(project_name, {}).get(url, {}).get('state')
+        publish_transient(project_name, event)
+
+    def forget(self, project_name):
+        with self.lock:
+            self.urls.pop(project_name, None)
+
+    def refresh_stale(self):
+        with projects_lock:
+            project_urls = {name: list(p.get('urls', [])) for name, p in projects_state.items()}
+        for name, urls in project_urls.items():
+            page_index = get_page_index(name)
+            stale = [u for u in urls if page_index.is_stale(normalize_url(u), app.config['PAGE_CACHE_TTL'])]
+            self.enqueue(name, stale)
+
+    def refresh_loop(self):
+        time.sleep(app.config['CRAWL_START_DELAY'])
+        while True:
+            try:
+                self.refresh_stale()
+            except Exception as e:
+                print(f"Refreshing stale pages failed: {e}")
+            time.sleep(app.config['CRAWL_INTERVAL'])
+
+crawl_engine = FetchEngine(app.config['CRAWL_WORKERS'], 1)
+crawler = CrawlScheduler(crawl_engine)
+background_workers.append(('crawl-refresh', crawler.refresh_loop))
+
+def schedule_indexing(project_name, urls):
+    crawler.enqueue(project_name, urls)
+
+# --- Topic Grouping ---
+# /auto_group clusters a project's notes by content. A TopicModel keeps the
+# term counts of every note and the project's document frequencies; sync()
+# only tokenizes notes whose text or title changed since the last call and
+# subtracts deleted ones. group() turns the counts into L2-normalized TF-IDF
+# vectors and runs spherical k-means (cosine similarity). The number of topics
+# follows the data: starting from one cluster (or the previous grouping), the
+# least cohesive cluster is split in two until every cluster's mean similarity
+# to its centroid reaches AUTO_GROUP_MIN_COHESION. Notes that are not similar
+# enough to any centroid stay where they are, and each topic is labeled with
+# terms most of its notes contain; notes containing none of them are skipped.
+
+app.config['AUTO_GROUP_MAX_TOPICS'] = int(os.environ.get('AUTO_GROUP_MAX_TOPICS', 10))
+app.config['AUTO_GROUP_MAX_TERMS'] = int(os.environ.get('AUTO_GROUP_MAX_TERMS', 1000))
+app.config['AUTO_GROUP_MIN_COHESION'] = float(os.environ.get('AUTO_GROUP_MIN_COHESION', 0.5))
+app.config['AUTO_GROUP_MIN_SIMILARITY'] = float(os.environ.get('AUTO_GROUP_MIN_SIMILARITY', 0.1))
+
+TOPIC_STOP_WORDS = {
+    'und', 'oder', 'aber', 'den', 'die', 'das', 'der', 'dem', 'des', 'ein', 'eine', 'einer', 
+    'in', 'im', 'auf', 'aus', 'von', 'mit', 'für', 'bei', 'zum', 'zur', 'dass', 'ist', 'sind', 
+    'war', 'wird', 'werden', 'nicht', 'auch', 'sich', 'als', 'wie', 'es', 'an', 'zu', 'hat', 
+    'heute', 'dies', 'diese', 'jenes', 'the', 'and', 'or', 'of', 'to', 'in', 'a', 'is', 'for'
+}
+
+def note_terms(text, title):
+    content = f"{text} {title}".lower()
+    return Counter(w for w in WORD_RE.findall(content) if len(w) > 4 and w not in TOPIC_STOP_WORDS)
+
+def centroid_sums(X, labels, k):
+    assigned = np.flatnonzero(labels >= 0)
+    membership = np.zeros((k, len(X)), dtype=X.dtype)
+    membership[labels[assigned], assigned] = 1
+    return membership @ X
+
+def spherical_kmeans(X, k, init=None, iterations=20, seed=0, min_similarity=0.0):
+    """Clusters the unit-length rows of X; returns (labels, centroid sums).
+
+    Rows whose best similarity is not above min_similarity get the label -1.
+    """
+    rng = np.random.default_rng(seed)
+    # Start from the given centers, k-means++ seeding on cosine distance for the rest
+    centers = list(init) if init is not None and len(init) else [X[rng.integers(len(X))]]
+    distance = np.clip(1 - np.max(X @ np.array(centers).T, axis=1), 0, None)
+    while len(centers) < k and distance.sum() > 0:
+        i = rng.choice(len(X), p=distance / distance.sum())
+        centers.append(X[i])
+        distance = np.minimum(distance, np.clip(1 - X @ X[i], 0, None))
+    centers = np.array(centers)
+
+    labels = None
+    for _ in range(iterations):
+        similarity = X @ centers.T
+        new_labels = np.argmax(similarity, axis=1)
+        new_labels[similarity[np.arange(len(X)), new_labels] <= min_similarity] = -1
+        if labels is not None and np.array_equal(labels, new_labels):
+            break
+        labels = new_labels
+        sums = centroid_sums(X, labels, len(centers))
+        norms = np.linalg.norm(sums, axis=1)
+        filled = norms > 0
+        centers[filled] = sums[filled] / norms[filled, None]
+    return labels, centroid_sums(X, labels, len(centers))
+
+def unit_rows(M):
+    norms = np.linalg.norm(M, axis=1)
+    return M[norms > 0] / norms[norms > 0, None]
+
+class TopicModel:
+    def __init__(self):
+        self.notes = {}  # note id -> (text, title, term columns, term counts)
+        self.vocabulary = {}
+        self.terms = []
+        self.df = []
+        self.centers = None  # (term columns, unit centroids) of the last grouping
+
+    def _add(self, note_id, text, title):
+        counts = note_terms(text, title)
+        columns = []
+        for term in counts:
+            column = self.vocabulary.get(term)
+            if column is None:
+                column = self.vocabulary[term] = len(self.terms)
+                self.terms.append(term)
+                self.df.append(0)
+            self.df[column] += 1
+            columns.append(column)
+        self.notes[note_id] = (text, title, np.array(columns, dtype=np.intp),
+                               np.array(list(counts.values()), dtype=np.float32))
+
+    def _remove(self, note_id):
+        for column in self.notes.pop(note_id)[2]:
+            self.df[column] -= 1
+
+    def sync(self, notes):
+        live = set()
+        for note in notes:
+            note_id = note['id']
+            text = note.get('text') or ''
+            title = note.get('title') or ''
+            live.add(note_id)
+            entry = self.notes.get(note_id)
+            if entry is not None:
+                if entry[0] == text and entry[1] == title:
+                    continue
+                self._remove(note_id)
+            self._add(note_id, text, title)
+        for note_id in self.notes.keys() - live:
+            self._remove(note_id)
+
+    def group(self, notes, max_topics, max_terms, min_cohesion=0.5, min_similarity=0.1):
+        """Returns {note id: topic label} for the notes that share terms with others."""
+        self.sync(notes)
+        n = len(notes)
+        df = np.array(self.df, dtype=np.int64)
+        # Terms shared by at least two notes but not by most of them
+        candidates = np.flatnonzero((df >= 2) & (df <= max(2, n // 2)))
+        if len(candidates) > max_terms:
+            candidates = candidates[np.argsort(-df[candidates], kind='stable')[:max_terms]]
+        if not len(candidates):
+            return {}
+        feature = np.full(len(df), -1, dtype=np.intp)
+        feature[candidates] = np.arange(len(candidates))
+        idf = np.log((1 + n) / (1 + df[candidates])) + 1
+
+        entries = [self.notes[note['id']] for note in notes]
+        rows = np.repeat(np.arange(n), [len(e[2]) for e in entries])
+        columns = feature[np.concatenate([e[2] for e in entries])]
+        weights = 1 + np.log(np.concatenate([e[3] for e in entries]))
+        keep = columns >= 0
+        X = np.zeros((n, len(candidates)), dtype=np.float32)
+        X[rows[keep], columns[keep]] = weights[keep] * idf[columns[keep]]
+
+        norms = np.linalg.norm(X, axis=1)
+        members = np.flatnonzero(norms > 0)
+        if len(members) < 2:
+            return {}
+        X = X[members] / norms[members, None]
+
+        # Warm start from the previous centroids so that small edits keep the groups stable
+        init = None
+        if self.centers is not None:
+            old_columns, old_centers = self.centers
+            init = np.zeros((min(max_topics, len(old_centers)), len(candidates)), dtype=np.float32)
+            mapped = feature[old_columns]
+            init[:, mapped[mapped >= 0]] = old_centers[:len(init), mapped >= 0]
+            init = unit_rows(init)
+        k = len(init) if init is not None and len(init) else 1
+        labels, sums = spherical_kmeans(X, k, init)
+
+        # Split the least cohesive cluster until all of them are tight enough; only
+        # the final pass leaves notes out, so that no topic is lost while splitting
+        settled = set()
+        while len(sums) < max_topics:
+            sizes = np.bincount(labels[labels >= 0], minlength=len(sums))
+            cohesion = np.linalg.norm(sums, axis=1) / np.maximum(sizes, 1)
+            loose = [c for c in range(len(sums))
+                     if c not in settled and sizes[c] >= 4 and cohesion[c] < min_cohesion]
+            if not loose:
+                break
+            c = min(loose, key=lambda c: cohesion[c])
+            rows = np.flatnonzero(labels == c)
+            part, part_sums = spherical_kmeans(X[rows], 2, seed=len(sums))
+            if len(part_sums) < 2 or np.bincount(part[part >= 0], minlength=2).min() < 2:
+                settled.add(c)
+                continue
+            labels[rows] = np.where(part == 1, len(sums), np.where(part == 0, c, -1))
+            sums[c] = part_sums[0]
+            sums = np.vstack([sums, part_sums[1:]])
+        centers = unit_rows(sums)
+        if not len(centers):
+            return {}
+        labels, sums = spherical_kmeans(X, len(centers), centers, min_similarity=min_similarity)
+        self.centers = (candidates, unit_rows(sums))
+
+        topics = {}
+        for c, centroid in enumerate(sums):
+            rows = np.flatnonzero(labels == c)
+            if len(rows) < 2:
+                continue
+            # Name the topic after the terms most of its notes contain, strongest first
+            contained = np.count_nonzero(X[rows] > 0, axis=0)
+            order = np.lexsort((-centroid, -contained))
+            top = [order[0]] + [i for i in order[1:2] if contained[i] * 2 >= len(rows)]
+            label = "Thema: " + ", ".join(self.terms[candidates[i]].capitalize() for i in top)
+            for r in rows:
+                if (X[r, top] > 0).any():
+                    topics[notes[members[r]]['id']] = label
+        return topics
+
+topic_models = {}
+
+def get_topic_model(project_name):
+    if project_name not in topic_models:
+        topic_models[project_name] = TopicModel()
+    return topic_models[project_name]
+
+# --- Note Search ---
+# GET /search/notes ranks notes (text, title, tags, category) with BM25 in one
+# project or across all of them. Each project gets a NoteSearchIndex on first
+# use, built from a copy of its note list without holding projects_lock;
+# notes changed meanwhile are queued and applied before the index goes live.
+# From then on insert_note, remove_note, reposition_note and the routes that
+# edit notes keep it current, so a query never scans the notes themselves.
+# Terms are casefolded and stripped of diacritics, and the last word of the
+# query also matches as a prefix for type-ahead. Postings map a term to
+# {slot: weighted term frequency}; queries score them as numpy arrays, cached
+# per term until that term changes. Category and tag counts cover every
+# match, not only the returned page, so they can be offered as facets.
+
+NOTE_SEARCH_WEIGHTS = {'text': 1, 'title': 2, 'tags': 2, 'category': 1}
+NOTE_SEARCH_MAX_EXPANSIONS = 50  # most frequent completions of a prefix
+NOTE_SEARCH_MAX_RESULTS = 200
+NOTE_SEARCH_MAX_TAG_FACETS = 20
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+@functools.lru_cache(maxsize=65536)
+def fold_term(term):
+    return strip_diacritics(term)
+
+def search_terms(text):
+    if not text:
+        return []
+    return [t if t.isascii() else fold_term(t) for t in WORD_RE.findall(text.casefold())]
+
+class NoteSearchIndex:
+    def __init__(self):
+        self.slots = {}  # note id -> slot
+        self.docs = []  # slot -> (note id, rank, term frequencies, tags), None when free
+        self.free = []
+        self.live = np.zeros(0, dtype=bool)
+        self.lengths = np.zeros(0, dtype=np.float32)
+        self.categories = np.zeros(0, dtype=np.int32)
+        self.category_codes = {}
+        self.category_names = []
+        self.postings = {}
+        self.tag_slots = {}
+        self.arrays = {}  # term or ('tag', tag) -> numpy postings
+        self.vocabulary = []  # sorted, for prefix lookups
+        self.total_length = 0.0
+
+    def _new_slot(self):
+        if self.free:
+            return self.free.pop()
+        slot = len(self.docs)
+        self.docs.append(None)
+        if slot == len(self.live):
+            grow = max(64, slot)
+            self.live = np.concatenate([self.live, np.zeros(grow, dtype=bool)])
+            self.lengths = np.concatenate([self.lengths, np.zeros(grow, dtype=np.float32)])
+            self.categories = np.concatenate([self.categories, np.zeros(grow, dtype=np.int32)])
+        return slot
+
+    def add(self, note):
+        """Indexes the note, replacing what was indexed under its id before."""
+        self.remove(note['id'])
+        frequencies = Counter()
+        for field, weight in NOTE_SEARCH_WEIGHTS.items():
+            value = note.get(field)
+            if isinstance(value, list):
+                value = ' '.join(map(str, value))
+            frequencies.update(search_terms(value if isinstance(value, str) else None) * weight)
+        tags = {str(tag) for tag in note.get('tags') or ()}
+        category = note.get('category') or ''
+        if category not in self.category_codes:
+            self.category_codes[category] = len(self.category_names)
+            self.category_names.append(category)
+
+        slot = self._new_slot()
+        self.slots[note['id']] = slot
+        self.docs[slot] = (note['id'], note.get('rank', ''), frequencies, tags)
+        self.live[slot] = True
+        length = sum(frequencies.values())
+        self.lengths[slot] = length
+        self.total_length += length
+        self.categories[slot] = self.category_codes[category]
+        for term, frequency in frequencies.items():
+            docs = self.postings.get(term)
+            if docs is None:
+                docs = self.postings[term] = {}
+                bisect.insort(self.vocabulary, term)
+            docs[slot] = frequency
+        for tag in tags:
+            self.tag_slots.setdefault(tag, set()).add(slot)
+        if self.arrays:  # empty while the index is being built
+            for term in frequencies:
+                self.arrays.pop(term, None)
+            for tag in tags:
+                self.arrays.pop(('tag', tag), None)
+
+    def remove(self, note_id):
+        slot = self.slots.pop(note_id, None)
+        if slot is None:
+            return
+        _, _, frequencies, tags = self.docs[slot]
+        self.docs[slot] = None
+        self.free.append(slot)
+        self.live[slot] = False
+        self.total_length -= float(self.lengths[slot])
+        for term in frequencies:
+            docs = self.postings[term]
+            del docs[slot]
+            self.arrays.pop(term, None)
+            if not docs:
+                del self.postings[term]
+                del self.vocabulary[bisect.bisect_left(self.vocabulary, term)]
+        for tag in tags:
+            self.tag_slots[tag].discard(slot)
+            self.arrays.pop(('tag', tag), None)
+            if not self.tag_slots[tag]:
+                del self.tag_slots[tag]
+
+    def _term_postings(self, term):
+        arrays = self.arrays.get(term)
+        if arrays is None:
+            docs = self.postings[term]
+            arrays = self.arrays[term] = (np.fromiter(docs.keys(), dtype=np.intp, count=len(docs)),
+                                          np.fromiter(docs.values(), dtype=np.float32, count=len(docs)))
+        return arrays
+
+    def _tag_postings(self, tag):
+        key = ('tag', tag)
+        if key not in self.arrays:
+            slots = self.tag_slots.get(tag, ())
+            self.arrays[key] = np.fromiter(slots, dtype=np.intp, count=len(slots))
+        return self.arrays[key]
+
+    def expand(self, token, prefix):
+        if not prefix:
+            return [token] if token in self.postings else []
+        terms = []
+        i = bisect.bisect_left(self.vocabulary, token)
+        while i < len(self.vocabulary) and self.vocabulary[i].startswith(token):
+            terms.append(self.vocabulary[i])
+            i += 1
+        if len(terms) > NOTE_SEARCH_MAX_EXPANSIONS:
+            terms = heapq.nlargest(NOTE_SEARCH_MAX_EXPANSIONS, terms, key=lambda t: len(self.postings[t]))
+        return terms
+
+    def search(self, tokens, prefix=False, category=None, tag=None):
+        """Returns (BM25 score per slot, mask of the slots matching every token and filter)."""
+        size = len(self.docs)
+        n = len(self.slots)
+        scores = np.zeros(size, dtype=np.float32)
+        mask = self.live[:size].copy()
+        if tokens and n:
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[:size] / (self.total_length / n or 1))
+            for i, token in enumerate(tokens):
+                # A prefix stands for all its completions; a note scores by its best one
+                best = np.zeros(size, dtype=np.float32)
+                for term in self.expand(token, prefix and i == len(tokens) - 1):
+                    slots, frequencies = self._term_postings(term)
+                    idf = math.log(1 + (n - len(slots) + 0.5) / (len(slots) + 0.5))
+                    contribution = idf * frequencies * (BM25_K1 + 1) / (frequencies + norm[slots])
+                    best[slots] = np.maximum(best[slots], contribution)
+                mask &= best > 0
+                scores += best
+        if category is not None:
+            code = self.category_codes.get(category)
+            mask &= self.categories[:size] == code if code is not None else False
+        if tag is not None:
+            tagged = np.zeros(size, dtype=bool)
+            tagged[self._tag_postings(tag)] = True
+            mask &= tagged
+        return scores, mask
+
+    def facets(self, mask):
+        """Category and tag counts over the slots in mask."""
+        counts = np.bincount(self.categories[:len(mask)][mask], minlength=len(self.category_names))
+        categories = {self.category_names[code]: int(counts[code]) for code in np.flatnonzero(counts)}
+        tags = {}
+        for tag in self.tag_slots:
+            count = int(np.count_nonzero(mask[self._tag_postings(tag)]))
+            if count:
+                tags[tag] = count
+        return categories, tags
+
+    def top(self, scores, mask, k, ranked=True):
+        """[(note id, score)] of the k best slots in mask, or the first k in note order."""
+        slots = np.flatnonzero(mask)
+        if not ranked:
+            return [(self.docs[s][0], 0.0) for s in heapq.nsmallest(k, slots, key=lambda s: self.docs[s][1])]
+        if len(slots) > k:
+            slots = slots[np.argpartition(-scores[slots], k - 1)[:k]]
+        slots = slots[np.argsort(-scores[slots], kind='stable')]
+        return [(self.docs[s][0], float(scores[s])) for s in slots]
+
+note_search_build_lock = threading.Lock()
+
+def build_note_search_index(project_name):
+    """Builds a project's index if it has none yet. Caller must not hold projects_lock."""
+    with note_search_build_lock:
+        with projects_lock:
+            if project_name in note_search_indexes or project_name not in projects_state:
+                return
+            notes = list(projects_state[project_name].get('notes', []))
+            changes = note_search_builds[project_name] = []
+        index = NoteSearchIndex()
+        for note in notes:
+            index.add(note)
+        with projects_lock:
+            if note_search_builds.get(project_name) is not changes:
+                return  # project deleted or replaced meanwhile
+            del note_search_builds[project_name]
+            for note_id, note in changes:
+                if note is None:
+                    index.remove(note_id)
+                else:
+                    index.add(note)
+            note_search_indexes[project_name] = index
+
+def get_note_search_index(project_name):
+    """Caller holds projects_lock; see build_note_search_index to build without it."""
+    index = note_search_indexes.get(project_name)
+    if index is None:
+        index = note_search_indexes[project_name] = NoteSearchIndex()
+        for note in projects_state[project_name].get('notes', []):
+            index.add(note)
+    return index
+
+def index_note(project_name, note):
+    """Re-indexes a new or changed note. Caller holds projects_lock."""
+    index = note_search_indexes.get(project_name)
+    if index is not None:
+        index.add(note)
+    elif project_name in note_search_builds:
+        note_search_builds[project_name].append((note['id'], note))
+
+def unindex_note(project_name, note_id):
+    index = note_search_indexes.get(project_name)
+    if index is not None:
+        index.remove(note_id)
+    elif project_name in note_search_builds:
+        note_search_builds[project_name].append((note_id, None))
+
+# --- Image Store ---
+# Uploaded images are stored once per content: the upload is streamed to a
+# temporary file while hashing and then renamed to <sha256><ext>, so saving
+# the same screenshot again does not take more disk. image_worker creates
+# WebP thumbnails for new images (when Pillow is installed), keeps their size
+# in a small JSON sidecar and copies dimensions and thumbnail URLs into the
+# notes that show the image.
+#
+# Images saved from the web via /add_image_note are downloaded once in the
+# background through the fetch engine (so per-host limits apply), stored the
+# same way and the note is pointed at the local copy. Everything under
+# static/uploads is content-addressed and served with a one-year max-age.
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+app.config['IMAGE_THUMB_SIZES'] = [int(size) for size in os.environ.get('IMAGE_THUMB_SIZES', '320,960').split(',')]
+app.config['IMAGE_MAX_BYTES'] = int(os.environ.get('IMAGE_MAX_BYTES', 10 * 1024 * 1024))
+
+IMAGE_CHUNK_SIZE = 64 * 1024
+THUMB_FOLDER = os.path.join(UPLOAD_FOLDER, 'thumbs')
+os.makedirs(THUMB_FOLDER, exist_ok=True)
+image_jobs = queue.Queue()
+
+def image_url(name):
+    return f"/static/uploads/{name}"
+
+def store_image(chunks, filename):
+    """Writes the byte chunks of an image to the store; returns its file name."""
+    ext = os.path.splitext(secure_filename(filename or ''))[1].lower()
+    digest = hashlib.sha256()
+    tmp_path = os.path.join(app.config['UPLOAD_FOLDER'], f".{uuid.uuid4().hex}.tmp")
+    try:
+        with open(tmp_path, 'wb') as f:
+            for chunk in chunks:
+                digest.update(chunk)
+                f.write(chunk)
+        name = digest.hexdigest() + ext
+        path = os.path.join(app.config['UPLOAD_FOLDER'], name)
+        if os.path.exists(path):
+            os.remove(tmp_path)
+        else:
+            os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return name
+
+def image_metadata(name):
+    """Dimensions and thumbnail URLs of a stored image, created on first use."""
+    meta_path = os.path.join(THUMB_FOLDER, name + '.json')
+    try:
+        with open(meta_path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        pass
+    if Image is None:
+        return {}
+
+    meta = {'thumbs': {}}
+    stem = os.path.splitext(name)[0]
+    with Image.open(os.path.join(app.config['UPLOAD_FOLDER'], name)) as img:
+        meta['width'], meta['height'] = img.size
+        for size in sorted(app.config['IMAGE_THUMB_SIZES']):
+            if size >= max(img.size):
+                break
+            thumb = img.copy()
+            thumb.thumbnail((size, size))
+            if thumb.mode not in ('RGB', 'RGBA'):
+                thumb = thumb.convert('RGBA')
+            thumb_name = f"{stem}_{size}.webp"
+            thumb.save(os.path.join(THUMB_FOLDER, thumb_name), 'WEBP', quality=80)
+            meta['thumbs'][str(size)] = f"/static/uploads/thumbs/{thumb_name}"
+    tmp_file = meta_path + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp_file, meta_path)
+    return meta
+
+def image_worker():
+    while True:
+        project_name, note_id, name = image_jobs.get()
+        try:
+            meta = image_metadata(name)
+            if not meta:
+                continue
+            with projects_lock:
+                note = find_note(project_name, note_id)
+                if note is not None and note.get('url') == image_url(name):
+                    note['width'] = meta['width']
+                    note['height'] = meta['height']
+                    if meta['thumbs']:
+                        note['thumbs'] = meta['thumbs']
+                        note['thumb'] = next(iter(meta['thumbs'].values()))
+                    mark_note_changed(project_name, note_id)
+                    save_projects_to_disk(projects_state)
+        except Exception as e:
+            print(f"Processing image {name} failed: {e}")
+
+background_workers.append(('image-worker', image_worker))
+
+def download_image(project_name, note_id, src, page_url=None):
+    try:
+        if src.startswith('data:'):
+            header, _, payload = src[5:].partition(',')
+            if not header.startswith('image/'):
+                raise ValueError(f"Not an image: {header}")
+            content = base64.b64decode(payload) if header.endswith(';base64') else unquote_to_bytes(payload)
+            if len(content) > app.config['IMAGE_MAX_BYTES']:
+                raise PageTooLarge(f"Image is larger than {app.config['IMAGE_MAX_BYTES']} bytes")
+            ext = mimetypes.guess_extension(header.split(';')[0]) or ''
+            name = store_image([content], 'image' + ext)
+        else:
+            headers = {
+                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+                'Accept': 'image/*'
+            }
+            if page_url:
+                headers['Referer'] = page_url
+            # The proxy may hand over page-relative sources
+            url = urljoin(page_url, src) if page_url else src
+            deadline = time.time() + app.config['FETCH_MAX_SECONDS']
+            with request_page(url, headers, 15, deadline) as response:
+                response.raise_for_status()
+                content_type = response.headers.get('Content-Type', '').split(';')[0].strip()
+                if not content_type.startswith('image/'):
+                    raise ValueError(f"Not an image: {content_type or 'unknown type'}")
+                ext = mimetypes.guess_extension(content_type) or os.path.splitext(urlsplit(src).path)[1]
+                name = store_image(iter_body(response, app.config['IMAGE_MAX_BYTES'], deadline), 'image' + ext)
+
+        with projects_lock:
+            note = find_note(project_name, note_id)
+            if note is not None and note.get('url') == src:
+                note['url'] = image_url(name)
+                if not src.startswith('data:'):
+                    note['remote_url'] = src
+                mark_note_changed(project_name, note_id)
+                save_projects_to_disk(projects_state)
+                image_jobs.put((project_name, note_id, name))
+    except Exception as e:
+        print(f"Downloading image {src[:100]} failed: {e}")
+
+@app.after_request
+def cache_stored_images(response):
+    if request.path.startswith('/static/uploads/') and response.status_code == 200:
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = 365 * 24 * 3600
+        response.cache_control.immutable = True
+    return response
+
 @app.route('/')
 @app.route('/dashboard')
 @app.route('/library')
@@ -102,26 +2223,317 @@ def index(note_id=None):
     return render_template('index.html')
 
 
+def search_budget(data):
+    try:
+        budget = float(data.get('budget') or app.config['SEARCH_BUDGET'])
+    except (TypeError, ValueError):
+        budget = app.config['SEARCH_BUDGET']
+    return min(max(budget, 1), app.config['SEARCH_MAX_BUDGET'])
+
+def run_search(urls, keywords, project_name=None, whole_word=False, fold_diacritics=False, budget=None):
+    """Yields one search_in_url-style result per URL as soon as it is ready.
+
+    URLs still without an answer after budget seconds (default SEARCH_BUDGET)
+    are yielded with status 'timeout' instead of being waited for.
+    """
+    budget = budget or app.config['SEARCH_BUDGET']
+    deadline = time.time() + budget
+    page_index = None
+    own_urls = set()
+    with projects_lock:
+        project = projects_state.get(project_name) if project_name else None
+        if project is not None:
+            own_urls = {normalize_url(u) for u in project.get('urls', [])}
+    if project is not None:
+        page_index = get_page_index(project_name)
+        indexed = page_index.search([normalize_url(u) for u in urls], keywords, whole_word, fold_diacritics)
+        urls = [u for u in urls if normalize_url(u) not in indexed]
+        inc('cache_requests_total', len(indexed), cache='page_index', result='hit')
+        inc('cache_requests_total', len(urls), cache='page_index', result='miss')
+        # Serve what we have and refresh stale pages in the background
+        stale = [u for u in indexed if page_index.is_stale(u, app.config['PAGE_CACHE_TTL'])]
+        schedule_indexing(project_name, stale)
+        yield from indexed.values()
+    
+    # Pages fetched for URLs outside the project are searched but not indexed
+    pending = {fetch_engine.submit(url, search_in_url, url, keywords,
+                                   page_index if normalize_url(url) in own_urls else None,
+                                   whole_word, fold_diacritics, deadline): url
+               for url in urls}
+    try:
+        for future in concurrent.futures.as_completed(list(pending), timeout=max(0, deadline - time.time())):
+            del pending[future]
+            yield future.result()
+    except concurrent.futures.TimeoutError:
+        # Queued fetches are dropped; running ones stop at the same deadline
+        inc('search_timeouts_total', len(pending))
+        for future, url in pending.items():
+            future.cancel()
+            yield {'url': normalize_url(url), 'status': 'timeout', 'message': f"No answer within {budget:g}s"}
+
 @app.route('/search', methods=['POST'])
 def search():
     data = request.json
     urls = data.get('urls', [])
     keywords = data.get('keywords', [])
+    project_name = data.get('project')
     
     if not urls or not keywords:
         return jsonify({'error': 'Please provide both URLs and keywords'}), 400
     
-    with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
-        future_to_url = {executor.submit(search_in_url, url, keywords): url for url in urls}
-        results = [future.result() for future in concurrent.futures.as_completed(future_to_url)]
-        
-    return jsonify(results)
+    return jsonify(list(run_search(urls, keywords, project_name,
+                                   bool(data.get('whole_word')), bool(data.get('ignore_diacritics')),
+                                   search_budget(data))))
+
+@app.route('/search/stream', methods=['POST'])
+def search_stream():
+    """Same as /search, but streams NDJSON: one 'result' line per URL, then a 'summary' line."""
+    data = request.json
+    urls = data.get('urls', [])
+    keywords = data.get('keywords', [])
+    project_name = data.get('project')
+    
+    if not urls or not keywords:
+        return jsonify({'error': 'Please provide both URLs and keywords'}), 400
+    
+    whole_word = bool(data.get('whole_word'))
+    fold_diacritics = bool(data.get('ignore_diacritics'))
+    budget = search_budget(data)
+    
+    def generate():
+        started = time.time()
+        statuses = Counter()
+        for result in run_search(urls, keywords, project_name, whole_word, fold_diacritics, budget):
+            statuses[result['status']] += 1
+            yield json.dumps(dict(result, type='result')) + '\n'
+        yield json.dumps({
+            'type': 'summary',
+            'total': sum(statuses.values()),
+            'success': statuses['success'],
+            'errors': statuses['error'],
+            'timeouts': statuses['timeout'],
+            'duration_ms': int((time.time() - started) * 1000)
+        }) + '\n'
+    
+    return Response(generate(), mimetype='application/x-ndjson',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/search/notes', methods=['GET'])
+def search_notes():
+    query = request.args.get('q', '')
+    project_name = request.args.get('project') or None
+    category = request.args.get('category')
+    tag = request.args.get('tag')
+    limit = max(1, min(request.args.get('limit', 20, type=int), NOTE_SEARCH_MAX_RESULTS))
+    offset = max(0, request.args.get('offset', 0, type=int))
+    # Type-ahead: the word being typed is a prefix until it is followed by a space
+    prefix = request.args.get('prefix', 'true') == 'true' and not query[-1:].isspace()
+    tokens = list(dict.fromkeys(search_terms(query)))
+
+    with projects_lock:
+        names = [project_name] if project_name is not None else list(projects_state)
+    for name in names:
+        build_note_search_index(name)
+
+    with projects_lock, span('match'):
+        if project_name is not None and project_name not in projects_state:
+            return jsonify({'error': 'Project not found'}), 404
+        names = [name for name in names if name in projects_state]
+        hits = []
+        total = 0
+        categories = Counter()
+        tags = Counter()
+        for name in names:
+            index = get_note_search_index(name)
+            scores, mask = index.search(tokens, prefix, category, tag)
+            total += int(np.count_nonzero(mask))
+            project_categories, project_tags = index.facets(mask)
+            categories.update(project_categories)
+            tags.update(project_tags)
+            hits.extend((score, name, note_id) for note_id, score in index.top(scores, mask, offset + limit, bool(tokens)))
+        if tokens:
+            hits.sort(key=lambda hit: -hit[0])
+        results = [{'project': name, 'score': round(score, 4), 'note': copy.deepcopy(find_note(name, note_id))}
+                   for score, name, note_id in hits[offset:offset + limit]]
+
+    return jsonify({
+        'query': query,
+        'total': total,
+        'results': results,
+        'facets': {
+            'category': dict(categories.most_common()),
+            'tags': dict(tags.most_common(NOTE_SEARCH_MAX_TAG_FACETS)),
+        },
+    })
+
+# --- Read API ---
+# GET /projects only lists project summaries; the client fetches the project it
+# shows through /projects/<name> (optionally ?fields=a,b) and long lists page
+# by page through /projects/<name>/notes and /projects/<name>/urls. Notes use
+# the last rank seen as cursor, so pages stay aligned while notes are added or
+# moved. Every response carries a strong ETag (hash of the body, suffixed per
+# content encoding) and is kept per store generation together with its
+# compressed variants, so revalidating unchanged data answers 304 without
+# serializing or compressing anything. All variants count against the budget.
+
+app.config['API_PAGE_SIZE'] = int(os.environ.get('API_PAGE_SIZE', 100))
+app.config['API_MAX_PAGE_SIZE'] = int(os.environ.get('API_MAX_PAGE_SIZE', 1000))
+app.config['API_CACHE_MAX_BYTES'] = int(os.environ.get('API_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+API_MIN_COMPRESS_BYTES = 1024
+
+api_cache = OrderedDict()  # (path, query) -> {'generation', 'etag', 'variants'}
+api_cache_size = 0
+api_cache_lock = threading.Lock()
+
+def trim_api_cache():
+    global api_cache_size
+    while api_cache_size > app.config['API_CACHE_MAX_BYTES'] and len(api_cache) > 1:
+        _, evicted = api_cache.popitem(last=False)
+        api_cache_size -= sum(len(v) for v in evicted['variants'].values())
+
+def store_api_entry(key, entry):
+    global api_cache_size
+    with api_cache_lock:
+        old = api_cache.pop(key, None)
+        if old is not None:
+            api_cache_size -= sum(len(v) for v in old['variants'].values())
+        api_cache[key] = entry
+        api_cache_size += sum(len(v) for v in entry['variants'].values())
+        trim_api_cache()
+
+def api_response(build, missing='Project not found'):
+    """JSON response for build(), which runs under projects_lock and returns None for a 404."""
+    global api_cache_size
+    key = (request.path, request.query_string)
+    with api_cache_lock:
+        entry = api_cache.get(key)
+        if entry is not None:
+            api_cache.move_to_end(key)
+    if entry is None or entry['generation'] != projects_generation:
+        inc('cache_requests_total', cache='api', result='miss')
+        with projects_lock, span('load'):
+            generation = projects_generation
+            payload = build()
+            body = None if payload is None else json.dumps(payload).encode('utf-8')
+        if body is None:
+            return jsonify({'error': missing}), 404
+        etag = hashlib.sha1(body).hexdigest()
+        if entry is not None and entry['etag'] == etag:
+            # Unchanged by the new generation, keep the compressed variants
+            entry = dict(entry, generation=generation, variants=dict(entry['variants']))
+        else:
+            entry = {'generation': generation, 'etag': etag, 'variants': {'identity': body}}
+        store_api_entry(key, entry)
+    else:
+        inc('cache_requests_total', cache='api', result='hit')
+
+    variants = entry['variants']
+    encoding = 'identity'
+    if len(variants['identity']) >= API_MIN_COMPRESS_BYTES:
+        encoding = choose_content_encoding(request.accept_encodings)
+    etag = encoded_etag(entry['etag'], encoding)
+    headers = {'ETag': f'"{etag}"', 'Vary': 'Accept-Encoding', 'Cache-Control': 'private, no-cache'}
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers=headers)
+
+    body = variants.get(encoding)
+    if body is None:
+        body = compress_body(variants['identity'], encoding)
+        with api_cache_lock:
+            if encoding not in variants:
+                variants[encoding] = body
+                if api_cache.get(key) is entry:
+                    api_cache_size += len(body)
+                    trim_api_cache()
+    if encoding != 'identity':
+        headers['Content-Encoding'] = encoding
+    return Response(body, mimetype='application/json', headers=headers)
+
+def project_summary(project):
+    return {
+        'keywords': project.get('keywords', ''),
+        'url_count': len(project.get('urls', [])),
+        'note_count': len(project.get('notes', [])),
+        'version': project.get('version', 0),
+    }
+
+def requested_fields():
+    fields = request.args.get('fields')
+    return [f.strip() for f in fields.split(',') if f.strip()] if fields else None
+
+def select_fields(item, fields):
+    return item if fields is None else {f: item[f] for f in fields if f in item}
+
+def page_size():
+    limit = request.args.get('limit', type=int) or app.config['API_PAGE_SIZE']
+    return max(1, min(limit, app.config['API_MAX_PAGE_SIZE']))
 
 @app.route('/projects', methods=['GET'])
 def get_projects():
-    return jsonify(load_projects_from_disk())
+    return api_response(lambda: {name: project_summary(p) for name, p in projects_state.items()})
+
+@app.route('/projects/<name>', methods=['GET'])
+def get_project(name):
+    def build():
+        project = projects_state.get(name)
+        if project is None:
+            return None
+        fields = requested_fields()
+        if fields is None:
+            return project
+        return select_fields({**project_summary(project), **project}, fields)
+    return api_response(build)
+
+@app.route('/projects/<name>/notes', methods=['GET'])
+def get_project_notes(name):
+    def build():
+        if name not in projects_state:
+            return None
+        notes = projects_state[name].get('notes', [])
+        start = 0
+        cursor = request.args.get('cursor')
+        if cursor:
+            start = rank_position(notes, cursor)
+            if start < len(notes) and notes[start]['rank'] == cursor:
+                start += 1
+        page = notes[start:start + page_size()]
+        fields = requested_fields()
+        return {
+            'notes': [select_fields(note, fields) for note in page],
+            'total': len(notes),
+            'next_cursor': page[-1]['rank'] if start + len(page) < len(notes) else None,
+        }
+    return api_response(build)
+
+@app.route('/projects/<name>/notes/<note_id>', methods=['GET'])
+def get_project_note(name, note_id):
+    return api_response(lambda: find_note(name, note_id), missing='Note not found')
+
+@app.route('/projects/<name>/urls', methods=['GET'])
+def get_project_urls(name):
+    def build():
+        if name not in projects_state:
+            return None
+        urls = projects_state[name].get('urls', [])
+        cursor = request.args.get('cursor', '')
+        start = int(cursor) if cursor.isdigit() else 0
+        end = start + page_size()
+        return {
+            'urls': urls[start:end],
+            'total': len(urls),
+            'next_cursor': str(end) if end < len(urls) else None,
+        }
+    return api_response(build)
+
+def project_urls_changed(name, old_urls, new_urls):
+    """Crawls added URLs and drops removed ones from the page index."""
+    schedule_indexing(name, [u for u in new_urls if u not in old_urls])
+    removed = {normalize_url(u) for u in old_urls} - {normalize_url(u) for u in new_urls}
+    for url in removed:
+        get_page_index(name).remove_document(url)
 
 @app.route('/projects', methods=['POST'])
+@with_projects_lock
 def save_project():
     data = request.json
     name = data.get('name')
@@ -129,6 +2541,7 @@ def save_project():
         return jsonify({'error': 'Project name is required'}), 400
     
     projects = load_projects_from_disk()
+    old_urls = projects.get(name, {}).get('urls', [])
     if name not in projects:
         projects[name] = {
             'urls': data.get('urls', []),
@@ -136,15 +2549,23 @@ def save_project():
             'notes': [],
             'mindmap': data.get('mindmap', [])
         }
+        mark_project_changed(name)
     else:
+        conflict = version_conflict(projects[name])
+        if conflict:
+            return conflict
         if 'urls' in data: projects[name]['urls'] = data['urls']
         if 'keywords' in data: projects[name]['keywords'] = data['keywords']
         if 'mindmap' in data: projects[name]['mindmap'] = data['mindmap']
+        mark_fields_changed(name)
+    version = bump_project_version(projects[name])
     
     save_projects_to_disk(projects)
-    return jsonify({'status': 'success'})
+    project_urls_changed(name, old_urls, projects[name]['urls'])
+    return jsonify({'status': 'success', 'version': version})
 
 @app.route('/add_url', methods=['POST'])
+@with_projects_lock
 def add_url_to_project():
     data = request.json
     project_name = data.get('project')
@@ -155,49 +2576,82 @@ def add_url_to_project():
         
     projects = load_projects_from_disk()
     if project_name in projects:
-        if new_url not in projects[project_name]['urls']:
-            projects[project_name]['urls'].append(new_url)
+        urls = projects[project_name].setdefault('urls', [])
+        if new_url not in urls:
+            urls.append(new_url)
+            bump_project_version(projects[project_name])
+            mark_fields_changed(project_name)
             save_projects_to_disk(projects)
+            schedule_indexing(project_name, [new_url])
         return jsonify({'status': 'success'})
     return jsonify({'error': 'Project not found'}), 404
 
 
 @app.route('/projects/<name>', methods=['DELETE'])
+@with_projects_lock
 def delete_project(name):
     projects = load_projects_from_disk()
     if name in projects:
         del projects[name]
+        note_indexes.pop(name, None)
+        note_search_indexes.pop(name, None)
+        note_search_builds.pop(name, None)
+        topic_models.pop(name, None)
+        crawler.forget(name)
         save_projects_to_disk(projects)
+        drop_page_index(name)
         return jsonify({'status': 'success'})
     return jsonify({'error': 'Project not found'}), 404
 
+def new_note(data):
+    note = {
+        'text': data.get('text'),
+        'url': data.get('url'),
+        'title': data.get('title'),
+        'date': datetime.now().strftime('%Y-%m-%d %H:%M'),
+        'category': 'Unsortiert'  # Default category
+    }
+    edit_note_fields(note, data)
+    return note
+
+def edit_note_fields(note, data):
+    for field in ('text', 'category', 'tags'):
+        if data.get(field) is not None:
+            note[field] = data[field]
+
+def move_target(project_name, note, data):
+    """New list index for a /move_note style request, or None if nothing moves."""
+    index = note_position(project_name, note)
+    target = data.get('position') # Drag & drop: new index in the list
+    if data.get('before') is not None: # ...or the id of the note to drop in front of
+        target = note_position(project_name, find_note(project_name, data['before']))
+        if target > index:
+            target -= 1
+    elif data.get('direction') == 'up':
+        target = index - 1
+    elif data.get('direction') == 'down':
+        target = index + 1
+
+    notes = projects_state[project_name]['notes']
+    if isinstance(target, int) and 0 <= target < len(notes) and target != index:
+        return target
+    return None
+
 @app.route('/add_note', methods=['POST'])
+@with_projects_lock
 def add_note():
     data = request.json
     project_name = data.get('project')
-    text = data.get('text')
-    url = data.get('url')
-    title = data.get('title')
     
     projects = load_projects_from_disk()
     if project_name in projects:
-        if 'notes' not in projects[project_name]:
-            projects[project_name]['notes'] = []
-            
-        new_note = {
-            'id': str(datetime.now().timestamp()),
-            'text': text,
-            'url': url,
-            'title': title,
-            'date': datetime.now().strftime('%Y-%m-%d %H:%M'),
-            'category': 'Unsortiert'  # Default category
-        }
-        projects[project_name]['notes'].append(new_note)
+        note = insert_note(project_name, new_note(data))
         save_projects_to_disk(projects)
-        return jsonify({'status': 'success'})
+        return jsonify({'status': 'success', 'id': note['id']})
     return jsonify({'error': 'Project not found'}), 404
 
 @app.route('/delete_note', methods=['POST'])
+@with_projects_lock
 def delete_note():
     data = request.json
     project_name = data.get('project')
@@ -205,60 +2659,52 @@ def delete_note():
     
     projects = load_projects_from_disk()
     if project_name in projects and 'notes' in projects[project_name]:
-        projects[project_name]['notes'] = [n for n in projects[project_name]['notes'] if n.get('id') != note_id]
-        save_projects_to_disk(projects)
+        if remove_note(project_name, note_id) is not None:
+            save_projects_to_disk(projects)
         return jsonify({'status': 'success'})
     return jsonify({'error': 'Note not found'}), 404
 
 @app.route('/edit_note', methods=['POST'])
+@with_projects_lock
 def edit_note():
     data = request.json
     project_name = data.get('project')
     note_id = data.get('id')
-    new_text = data.get('text')
-    new_category = data.get('category')
-    new_tags = data.get('tags')
     
     projects = load_projects_from_disk()
-    if project_name in projects and 'notes' in projects[project_name]:
-        for note in projects[project_name]['notes']:
-            if note.get('id') == note_id:
-                if new_text is not None:
-                    note['text'] = new_text
-                if new_category is not None:
-                    note['category'] = new_category
-                if new_tags is not None:
-                    note['tags'] = new_tags
-                save_projects_to_disk(projects)
-                return jsonify({'status': 'success'})
+    note = find_note(project_name, note_id)
+    if note is not None:
+        edit_note_fields(note, data)
+        index_note(project_name, note)
+        mark_note_changed(project_name, note_id)
+        save_projects_to_disk(projects)
+        return jsonify({'status': 'success'})
 
     return jsonify({'error': 'Note not found'}), 404
 
 @app.route('/move_note', methods=['POST'])
+@with_projects_lock
 def move_note():
     data = request.json
     project_name = data.get('project')
     note_id = data.get('id')
-    direction = data.get('direction') # 'up' or 'down'
 
     projects = load_projects_from_disk()
-    if project_name in projects and 'notes' in projects[project_name]:
-        notes = projects[project_name]['notes']
-        index = next((i for i, n in enumerate(notes) if n.get('id') == note_id), None)
-        
-        if index is not None:
-            if direction == 'up' and index > 0:
-                notes[index], notes[index-1] = notes[index-1], notes[index]
-                save_projects_to_disk(projects)
-                return jsonify({'status': 'success'})
-            elif direction == 'down' and index < len(notes) - 1:
-                notes[index], notes[index+1] = notes[index+1], notes[index]
-                save_projects_to_disk(projects)
-                return jsonify({'status': 'success'})
-                
+    note = find_note(project_name, note_id)
+    if note is not None:
+        if data.get('before') is not None and find_note(project_name, data['before']) is None:
+            return jsonify({'error': 'Note not found'}), 404
+
+        target = move_target(project_name, note, data)
+        if target is not None:
+            reposition_note(project_name, note_id, target)
+            save_projects_to_disk(projects)
+            return jsonify({'status': 'success', 'rank': note['rank']})
+
     return jsonify({'status': 'no_change'})
 
 @app.route('/auto_group', methods=['POST'])
+@with_projects_lock
 def auto_group_notes():
     data = request.json
     project_name = data.get('project')
@@ -271,55 +2717,18 @@ def auto_group_notes():
     if not notes:
         return jsonify({'status': 'no_notes'})
 
-    # 1. Simple Keyword Extraction
-    stop_words = {
-        'und', 'oder', 'aber', 'den', 'die', 'das', 'der', 'dem', 'des', 'ein', 'eine', 'einer', 
-        'in', 'im', 'auf', 'aus', 'von', 'mit', 'für', 'bei', 'zum', 'zur', 'dass', 'ist', 'sind', 
-        'war', 'wird', 'werden', 'nicht', 'auch', 'sich', 'als', 'wie', 'es', 'an', 'zu', 'hat', 
-        'heute', 'dies', 'diese', 'jenes', 'the', 'and', 'or', 'of', 'to', 'in', 'a', 'is', 'for'
-    }
-    
-    # Collect all words to find common themes
-    all_words = []
-    for note in notes:
-        # Clean text: lowercase, remove special chars
-        clean_text = re.sub(r'[^\w\s]', '', (note.get('text', '') + ' ' + note.get('title', '')).lower())
-        words = [w for w in clean_text.split() if len(w) > 4 and w not in stop_words]
-        all_words.extend(words)
-    
-    # Find words that appear frequently (potential topics)
-    word_counts = Counter(all_words)
-    # Filter for words that appear in at least 2 different notes would be better, 
-    # but strictly counting occurrences is a good proxy for "Topic"
-    common_topics = [word for word, count in word_counts.most_common(10) if count > 1]
-    
+    topics = get_topic_model(project_name).group(
+        notes, app.config['AUTO_GROUP_MAX_TOPICS'], app.config['AUTO_GROUP_MAX_TERMS'],
+        app.config['AUTO_GROUP_MIN_COHESION'], app.config['AUTO_GROUP_MIN_SIMILARITY'])
+
     changes = 0
     for note in notes:
-        # Only regroup 'Unsortiert' to avoid messing up manual work? 
-        # User asked for "smart grouping", implies doing the job for them. 
-        # Let's be aggressive but respect existing proper categories if possible.
-        # Actually, let's just categorize everything that matches a hot topic.
-        
-        current_cat = note.get('category', 'Unsortiert')
-        
-        # Check if note matches a topic
-        note_content = (note.get('text', '') + ' ' + note.get('title', '')).lower()
-        
-        best_topic = None
-        for topic in common_topics:
-            if topic in note_content:
-                best_topic = topic
-                break # Assign to the most frequent/important topic found first
-        
-        if best_topic:
-            # Capitalize topic for display
-            new_cat = f"Thema: {best_topic.capitalize()}"
-            if current_cat != new_cat:
-                note['category'] = new_cat
-                changes += 1
-        elif current_cat == 'Unsortiert':
-            # If no topic found, maybe keep Unsortiert
-            pass
+        new_cat = topics.get(note['id'])
+        if new_cat and note.get('category', 'Unsortiert') != new_cat:
+            note['category'] = new_cat
+            index_note(project_name, note)
+            mark_note_changed(project_name, note['id'])
+            changes += 1
 
     if changes > 0:
         save_projects_to_disk(projects)
@@ -336,32 +2745,33 @@ def upload_image():
     
     if file.filename == '' or not project_name:
         return jsonify({'error': 'Missing data'}), 400
+    with projects_lock:
+        if project_name not in projects_state:
+            return jsonify({'error': 'Project not found'}), 404
         
     if file:
-        filename = secure_filename(f"{int(datetime.now().timestamp())}_{file.filename}")
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
+        # Stream to disk outside the store lock, uploads can be slow
+        name = store_image(iter(lambda: file.stream.read(IMAGE_CHUNK_SIZE), b''), file.filename)
         
-        projects = load_projects_from_disk()
-        if project_name in projects:
-            if 'notes' not in projects[project_name]:
-                projects[project_name]['notes'] = []
-                
-            projects[project_name]['notes'].append({
-                'id': str(datetime.now().timestamp()),
-                'text': "Bild hochgeladen",
-                'url': f"/static/uploads/{filename}",
-                'title': file.filename,
-                'date': datetime.now().strftime('%Y-%m-%d %H:%M'),
-                'category': 'Bilder',
-                'type': 'image'
-            })
-            save_projects_to_disk(projects)
-            return jsonify({'status': 'success'})
+        with projects_lock:
+            projects = load_projects_from_disk()
+            if project_name in projects:
+                note = insert_note(project_name, {
+                    'text': "Bild hochgeladen",
+                    'url': image_url(name),
+                    'title': file.filename,
+                    'date': datetime.now().strftime('%Y-%m-%d %H:%M'),
+                    'category': 'Bilder',
+                    'type': 'image'
+                })
+                save_projects_to_disk(projects)
+                image_jobs.put((project_name, note['id'], name))
+                return jsonify({'status': 'success'})
             
     return jsonify({'error': 'Upload failed'}), 500
 
 @app.route('/add_image_note', methods=['POST'])
+@with_projects_lock
 def add_image_note():
     data = request.json
     project_name = data.get('project')
@@ -370,11 +2780,7 @@ def add_image_note():
     
     projects = load_projects_from_disk()
     if project_name in projects:
-        if 'notes' not in projects[project_name]:
-            projects[project_name]['notes'] = []
-            
-        projects[project_name]['notes'].append({
-            'id': str(datetime.now().timestamp()),
+        note = insert_note(project_name, {
             'text': "Bild aus dem Web",
             'url': image_src,
             'title': "Web Image",
@@ -384,6 +2790,8 @@ def add_image_note():
             'source_page': page_url
         })
         save_projects_to_disk(projects)
+        if image_src:
+            fetch_engine.submit(image_src, download_image, project_name, note['id'], image_src, page_url)
         return jsonify({'status': 'success'})
     return jsonify({'error': 'Project not found'}), 404
 
@@ -395,63 +2803,827 @@ def note_editor_view():
     if not project_name or not note_id:
         return "Missing parameters", 400
         
-    projects = load_projects_from_disk()
-    if project_name not in projects:
-        return "Project not found", 404
-        
-    target_note = None
-    for note in projects[project_name].get('notes', []):
-        if note.get('id') == note_id:
-            target_note = note
-            break
+    with projects_lock:
+        projects = load_projects_from_disk()
+        if project_name not in projects:
+            return "Project not found", 404
+            
+        target_note = copy.deepcopy(find_note(project_name, note_id))
             
     if not target_note:
         return "Note not found", 404
         
     return render_template('note_editor.html', project=project_name, note=target_note)
 
-@app.route('/export/<name>', methods=['GET'])
-def export_project(name):
+# --- Patches and Batches ---
+# Each project carries a `version` that goes up whenever its own fields
+# (urls, keywords, mindmap, ...) change. PATCH /projects/<name> applies an
+# RFC 6902 JSON Patch to those fields, so the mindmap is edited node by node
+# instead of being replaced wholesale; sending the version as If-Match turns a
+# concurrent change from another tab into a 412 instead of a silent
+# overwrite. POST /batch applies a list of note and URL operations under one
+# lock and one save. Every operation is checked before any is applied, so a
+# batch either applies completely or not at all. Notes are not versioned:
+# they are edited one by one and never replaced wholesale.
+
+READ_ONLY_FIELDS = ('notes', 'version')
+BATCH_NOTE_OPS = ('edit_note', 'delete_note', 'move_note')
+BATCH_URL_OPS = ('add_url', 'remove_url')
+
+class PatchError(Exception):
+    def __init__(self, message, status=422):
+        super().__init__(message)
+        self.status = status
+
+def bump_project_version(project):
+    project['version'] = project.get('version', 0) + 1
+    return project['version']
+
+def version_conflict(project):
+    """412 response if If-Match (or the body's `version`) is not the project's version."""
+    expected = request.if_match
+    if not expected:
+        version = request.json.get('version') if isinstance(request.json, dict) else None
+        if version is None:
+            return None
+        expected = ETags([str(version)])
+    if expected.contains(str(project.get('version', 0))):
+        return None
+    return jsonify({'error': 'Version conflict', 'version': project.get('version', 0)}), 412
+
+def pointer_tokens(path):
+    if not isinstance(path, str) or not path.startswith('/'):
+        raise PatchError(f"Invalid path {path!r}", 400)
+    tokens = [t.replace('~1', '/').replace('~0', '~') for t in path[1:].split('/')]
+    if tokens[0] in READ_ONLY_FIELDS:
+        raise PatchError(f"{tokens[0]!r} cannot be patched")
+    return tokens
+
+def list_index(items, token, path, append=False):
+    if append and token == '-':
+        return len(items)
+    if not token.isdigit() or (token != '0' and token.startswith('0')):
+        raise PatchError(f"Invalid array index in {path!r}")
+    index = int(token)
+    if index > len(items) or (index == len(items) and not append):
+        raise PatchError(f"Index out of range in {path!r}")
+    return index
+
+def patch_parent(doc, path):
+    tokens = pointer_tokens(path)
+    parent = doc
+    for token in tokens[:-1]:
+        if isinstance(parent, list):
+            parent = parent[list_index(parent, token, path)]
+        elif isinstance(parent, dict) and token in parent:
+            parent = parent[token]
+        else:
+            raise PatchError(f"Path not found: {path!r}")
+    return parent, tokens[-1]
+
+def patch_get(doc, path):
+    parent, token = patch_parent(doc, path)
+    if isinstance(parent, list):
+        return parent[list_index(parent, token, path)]
+    if isinstance(parent, dict) and token in parent:
+        return parent[token]
+    raise PatchError(f"Path not found: {path!r}")
+
+def patch_add(doc, path, value):
+    parent, token = patch_parent(doc, path)
+    if isinstance(parent, list):
+        parent.insert(list_index(parent, token, path, append=True), value)
+    elif isinstance(parent, dict):
+        parent[token] = value
+    else:
+        raise PatchError(f"Path not found: {path!r}")
+
+def patch_remove(doc, path):
+    parent, token = patch_parent(doc, path)
+    if isinstance(parent, list):
+        return parent.pop(list_index(parent, token, path))
+    if isinstance(parent, dict) and token in parent:
+        return parent.pop(token)
+    raise PatchError(f"Path not found: {path!r}")
+
+def apply_json_patch(doc, operations):
+    """Applies RFC 6902 operations to doc in place."""
+    if not isinstance(operations, list):
+        raise PatchError('Patch must be a list of operations', 400)
+    for operation in operations:
+        if not isinstance(operation, dict):
+            raise PatchError('Patch operations must be objects', 400)
+        kind = operation.get('op')
+        path = operation.get('path')
+        if kind in ('add', 'replace', 'test') and 'value' not in operation:
+            raise PatchError(f"'{kind}' needs a value", 400)
+        if kind == 'add':
+            patch_add(doc, path, copy.deepcopy(operation['value']))
+        elif kind == 'remove':
+            patch_remove(doc, path)
+        elif kind == 'replace':
+            patch_remove(doc, path)
+            patch_add(doc, path, copy.deepcopy(operation['value']))
+        elif kind == 'move':
+            source = operation.get('from')
+            if isinstance(source, str) and isinstance(path, str) and path.startswith(source + '/'):
+                raise PatchError(f"Cannot move {source!r} into itself")
+            patch_add(doc, path, patch_remove(doc, source))
+        elif kind == 'copy':
+            patch_add(doc, path, copy.deepcopy(patch_get(doc, operation.get('from'))))
+        elif kind == 'test':
+            if patch_get(doc, path) != operation['value']:
+                raise PatchError(f"Test failed at {path!r}", 409)
+        else:
+            raise PatchError(f"Unknown patch operation {kind!r}", 400)
+
+@app.route('/projects/<name>', methods=['PATCH'])
+@with_projects_lock
+def patch_project(name):
     projects = load_projects_from_disk()
     if name not in projects:
-        return "Project not found", 404
-        
+        return jsonify({'error': 'Project not found'}), 404
     project = projects[name]
-    output = f"# Projekt: {name}\n\n"
-    output += f"Exportiert am: {datetime.now().strftime('%d.%m.%Y %H:%M')}\n\n"
-    
-    output += "## 📚 Quellen / URLs\n"
-    for url in project.get('urls', []):
-        output += f"- {url}\n"
-    
-    output += "\n## 📝 Notizen\n"
-    for note in project.get('notes', []):
-        output += f"### {note.get('title', 'Quelle')}\n"
-        output += f"> \"{note.get('text')}\"\n\n"
-        output += f"*Quelle: {note.get('url')} ({note.get('date')})*\n\n---\n\n"
+    conflict = version_conflict(project)
+    if conflict:
+        return conflict
+
+    fields = {k: copy.deepcopy(v) for k, v in project.items() if k not in READ_ONLY_FIELDS}
+    fields.setdefault('urls', [])
+    fields.setdefault('mindmap', [])
+    try:
+        apply_json_patch(fields, request.json)
+        if not isinstance(fields.get('urls'), list) or not isinstance(fields.get('mindmap'), list):
+            raise PatchError('urls and mindmap are required and must be lists')
+    except PatchError as e:
+        return jsonify({'error': str(e)}), e.status
+
+    old_urls = project.get('urls', [])
+    for key in [k for k in project if k not in READ_ONLY_FIELDS and k not in fields]:
+        del project[key]
+    project.update(fields)
+    version = bump_project_version(project)
+    mark_fields_changed(name)
+    save_projects_to_disk(projects)
+    project_urls_changed(name, old_urls, project.get('urls', []))
+    return jsonify({'status': 'success', 'version': version})
+
+def batch_error(project_name, operations):
+    """Why the batch cannot be applied, or None. Caller holds projects_lock."""
+    if not isinstance(operations, list):
+        return 'ops must be a list'
+    deleted = set()
+    for i, operation in enumerate(operations):
+        kind = operation.get('op') if isinstance(operation, dict) else None
+        if kind in BATCH_NOTE_OPS:
+            note_ids = [operation.get('id')]
+            if kind == 'move_note' and operation.get('before') is not None:
+                note_ids.append(operation['before'])
+            for note_id in note_ids:
+                if not isinstance(note_id, str) or note_id in deleted or find_note(project_name, note_id) is None:
+                    return f"Operation {i}: note {note_id!r} not found"
+            if kind == 'delete_note':
+                deleted.add(operation['id'])
+        elif kind in BATCH_URL_OPS:
+            if not isinstance(operation.get('url'), str) or not operation['url']:
+                return f"Operation {i}: url is required"
+        elif kind != 'add_note':
+            return f"Operation {i}: unknown op {kind!r}"
+    return None
+
+def apply_batch_operation(project_name, operation):
+    project = projects_state[project_name]
+    kind = operation['op']
+    if kind == 'add_note':
+        return {'id': insert_note(project_name, new_note(operation))['id']}
+    if kind == 'add_url':
+        if operation['url'] not in project['urls']:
+            project['urls'].append(operation['url'])
+        return {}
+    if kind == 'remove_url':
+        if operation['url'] in project['urls']:
+            project['urls'].remove(operation['url'])
+        return {}
+    note = find_note(project_name, operation['id'])
+    if kind == 'edit_note':
+        edit_note_fields(note, operation)
+        index_note(project_name, note)
+        mark_note_changed(project_name, note['id'])
+    elif kind == 'delete_note':
+        remove_note(project_name, note['id'])
+    elif kind == 'move_note':
+        target = move_target(project_name, note, operation)
+        if target is not None:
+            reposition_note(project_name, note['id'], target)
+        return {'rank': note['rank']}
+    return {}
+
+@app.route('/batch', methods=['POST'])
+@with_projects_lock
+def batch():
+    data = request.json
+    project_name = data.get('project')
+    operations = data.get('ops')
+
+    projects = load_projects_from_disk()
+    if project_name not in projects:
+        return jsonify({'error': 'Project not found'}), 404
+    project = projects[project_name]
+    conflict = version_conflict(project)
+    if conflict:
+        return conflict
+    error = batch_error(project_name, operations)
+    if error:
+        return jsonify({'error': error}), 400
+
+    old_urls = list(project.setdefault('urls', []))
+    results = [apply_batch_operation(project_name, operation) for operation in operations]
+    if project['urls'] != old_urls:
+        bump_project_version(project)
+        mark_fields_changed(project_name)
+    if operations:
+        save_projects_to_disk(projects)
+    project_urls_changed(project_name, old_urls, project['urls'])
+    return jsonify({'status': 'success', 'results': results, 'version': project.get('version', 0)})
+
+# --- Export ---
+# Exports stream from a read transaction on the committed store: pending
+# writes are flushed first, then notes are read row by row in rank order, so
+# memory stays flat and the download starts right away no matter how many
+# notes a project has. Every format is a generator of text chunks; the zip
+# bundle runs them through a write-only zipfile and adds the uploaded images.
+
+EXPORT_CHUNK_SIZE = 64 * 1024
 
-    output += "\n## 🎓 Literaturverzeichnis / Quellen\n"
+def open_export_snapshot(name):
+    """Returns (connection, project fields) for a consistent read, or None."""
+    flush_projects()
+    # The response generator may be consumed by another thread than this one
+    conn = sqlite3.connect(PROJECTS_DB, isolation_level=None, check_same_thread=False)
+    conn.execute('BEGIN')
+    row = conn.execute('SELECT data FROM projects WHERE name = ?', (name,)).fetchone()
+    if row is None:
+        conn.close()
+        return None
+    return conn, json.loads(row[0])
+
+def iter_export_notes(conn, name):
+    for (data,) in conn.execute('SELECT data FROM notes WHERE project = ? ORDER BY rank', (name,)):
+        yield json.loads(data)
+
+def source_url(note):
+    """URL to cite for a note: where a re-hosted image came from, not its local copy."""
+    url = note.get('remote_url') or note.get('url')
+    if url and url.startswith('/static/uploads/'):
+        return None  # uploaded from disk, there is nothing to cite
+    return url
+
+def iter_sources(conn, name, project):
+    """Yields (url, note or None) for every distinct source, notes first."""
     seen_urls = set()
-    for note in project.get('notes', []):
-        url = note.get('url')
+    for note in iter_export_notes(conn, name):
+        url = source_url(note)
         if url and url not in seen_urls:
             seen_urls.add(url)
-            title = note.get('title', 'Ohne Titel')
-            date = note.get('date', 'unbekannt')
-            output += f"- {title}. Verfügbar unter: {url} (Abgerufen am: {date})\n"
-            
+            yield url, note
     # Also add urls that might strictly be in 'urls' list but have no notes yet
     for url in project.get('urls', []):
-         if url not in seen_urls:
-             seen_urls.add(url)
-             output += f"- Verfügbar unter: {url} (Gespeichert im Projekt)\n"
+        if url not in seen_urls:
+            seen_urls.add(url)
+            yield url, None
+
+def export_markdown(conn, name, project):
+    yield f"# Projekt: {name}\n\n"
+    yield f"Exportiert am: {datetime.now().strftime('%d.%m.%Y %H:%M')}\n\n"
+    
+    yield "## 📚 Quellen / URLs\n"
+    for url in project.get('urls', []):
+        yield f"- {url}\n"
+    
+    yield "\n## 📝 Notizen\n"
+    for note in iter_export_notes(conn, name):
+        yield (f"### {note.get('title', 'Quelle')}\n"
+               f"> \"{note.get('text')}\"\n\n"
+               f"*Quelle: {note.get('url')} ({note.get('date')})*\n\n---\n\n")
+
+    yield "\n## 🎓 Literaturverzeichnis / Quellen\n"
+    for url, note in iter_sources(conn, name, project):
+        if note is not None:
+            title = note.get('title', 'Ohne Titel')
+            date = note.get('date', 'unbekannt')
+            yield f"- {title}. Verfügbar unter: {url} (Abgerufen am: {date})\n"
+        else:
+            yield f"- Verfügbar unter: {url} (Gespeichert im Projekt)\n"
+
+def export_jsonl(conn, name, project):
+    yield json.dumps({'type': 'project', 'name': name, **project}, ensure_ascii=False) + "\n"
+    for note in iter_export_notes(conn, name):
+        yield json.dumps({'type': 'note', **note}, ensure_ascii=False) + "\n"
+
+BIBTEX_SPECIAL_RE = re.compile(r'[\\{}%&#$_]')
+BIBTEX_URL_SPECIAL_RE = re.compile(r'[%#]')
+
+def bibtex_escape(value, pattern=BIBTEX_SPECIAL_RE):
+    return pattern.sub(lambda m: r'\textbackslash{}' if m.group() == '\\' else '\\' + m.group(), str(value))
+
+def source_accessed(note):
+    """Access date of a source note as (year, month, day), or None."""
+    try:
+        accessed = datetime.strptime((note or {}).get('date') or '', '%Y-%m-%d %H:%M')
+    except ValueError:
+        return None
+    return accessed.year, accessed.month, accessed.day
+
+def export_bibtex(conn, name, project):
+    for n, (url, note) in enumerate(iter_sources(conn, name, project), 1):
+        fields = [
+            ('title', bibtex_escape((note or {}).get('title') or url)),
+            # url is a verbatim field in biblatex, only % and # need escaping
+            ('url', bibtex_escape(url, BIBTEX_URL_SPECIAL_RE)),
+        ]
+        accessed = source_accessed(note)
+        if accessed:
+            fields.append(('urldate', '%04d-%02d-%02d' % accessed))
+        body = ",\n".join(f"  {key} = {{{value}}}" for key, value in fields)
+        yield f"@online{{quelle{n},\n{body}\n}}\n\n"
+
+def export_csl_json(conn, name, project):
+    yield "["
+    for n, (url, note) in enumerate(iter_sources(conn, name, project), 1):
+        item = {'id': f"quelle{n}", 'type': 'webpage', 'title': (note or {}).get('title') or url, 'URL': url}
+        accessed = source_accessed(note)
+        if accessed:
+            item['accessed'] = {'date-parts': [list(accessed)]}
+        yield ("," if n > 1 else "") + "\n  " + json.dumps(item, ensure_ascii=False)
+    yield "\n]\n"
+
+EXPORT_FORMATS = {
+    # format: (generator, mimetype, file extension)
+    'md': (export_markdown, 'text/markdown', 'md'),
+    'jsonl': (export_jsonl, 'application/x-ndjson', 'jsonl'),
+    'bibtex': (export_bibtex, 'application/x-bibtex', 'bib'),
+    'csl': (export_csl_json, 'application/vnd.citationstyles.csl+json', 'json'),
+}
+
+def buffered(chunks, size=EXPORT_CHUNK_SIZE):
+    """Joins small text chunks into encoded blocks of roughly `size` bytes."""
+    buffer, length = [], 0
+    for chunk in chunks:
+        data = chunk.encode('utf-8')
+        buffer.append(data)
+        length += len(data)
+        if length >= size:
+            yield b''.join(buffer)
+            buffer, length = [], 0
+    if buffer:
+        yield b''.join(buffer)
+
+class ZipSink:
+    """Write-only, unseekable target for zipfile that hands out what was written."""
+    def __init__(self):
+        self.chunks = []
+        self.offset = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.offset
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+def zip_entry_name(title, fallback='export'):
+    """Slug of title that stays inside the extraction folder (no separators, '..' or drive letters)."""
+    slug = re.sub(r'[^\w.-]+', '_', title).strip('._')
+    return slug or fallback
+
+def export_zip(conn, name, project):
+    sink = ZipSink()
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as bundle:
+        for generator, _, extension in EXPORT_FORMATS.values():
+            with bundle.open(f"{zip_entry_name(name)}.{extension}", 'w') as entry:
+                for block in buffered(generator(conn, name, project)):
+                    entry.write(block)
+                    yield sink.drain()
+
+        added = set()
+        for note in iter_export_notes(conn, name):
+            url = note.get('url') or ''
+            if not url.startswith('/static/uploads/'):
+                continue
+            filename = os.path.basename(url)
+            path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+            if filename in added or not os.path.isfile(path):
+                continue
+            added.add(filename)
+            info = zipfile.ZipInfo(f"uploads/{zip_entry_name(filename, 'upload')}",
+                                   time.localtime(os.path.getmtime(path))[:6])
+            with open(path, 'rb') as src, bundle.open(info, 'w') as entry:
+                for block in iter(lambda: src.read(EXPORT_CHUNK_SIZE), b''):
+                    entry.write(block)
+                    yield sink.drain()
+    yield sink.drain()
+
+@app.route('/export/<name>', methods=['GET'])
+def export_project(name):
+    export_format = request.args.get('format', 'md')
+    if export_format != 'zip' and export_format not in EXPORT_FORMATS:
+        return "Unknown export format", 400
+
+    snapshot = open_export_snapshot(name)
+    if snapshot is None:
+        return "Project not found", 404
+    conn, project = snapshot
+
+    if export_format == 'zip':
+        chunks, mimetype, extension = export_zip(conn, name, project), 'application/zip', 'zip'
+    else:
+        generator, mimetype, extension = EXPORT_FORMATS[export_format]
+        chunks = buffered(generator(conn, name, project))
+
+    def generate():
+        try:
+            for chunk in chunks:
+                if chunk:
+                    yield chunk
+        finally:
+            conn.close()
 
     return Response(
-        output,
-        mimetype="text/markdown",
-        headers={"Content-disposition": f"attachment; filename={name}_export.md"}
+        generate(),
+        mimetype=mimetype,
+        headers={"Content-disposition": f"attachment; filename*=UTF-8''{quote(name)}_export.{extension}"}
     )
 
+# --- Proxy Rendering ---
+# rewrite_html walks the page once: tags get root-relative src/href pointed at
+# the original host, text between tags gets the keyword highlights, and the
+# contents of script/style-like elements, comments and attributes are copied
+# through untouched. Quoted attribute values are consumed whole, so a '>' in
+# them does not end the tag, and character references in text are never split
+# by a highlight.
+
+HTML_TAG_RE = re.compile(r'<!--.*?-->|<![^>]*>|<\?[^>]*>'
+                         r'''|<(/?)([a-zA-Z][^\s/>]*)(?:[^>=]|=\s*"[^"]*"|=\s*'[^']*'|=(?!\s*["']))*>''', re.S)
+HTML_ENTITY_RE = r'(?P<entity>&[#\w]+;)'
+ROOT_RELATIVE_ATTR_RE = re.compile(r'''(\s(?:src|href)\s*=\s*["']?)/(?!/)''', re.I)
+RAW_TEXT_TAGS = {'script', 'style', 'textarea', 'title', 'noscript', 'template', 'xmp'}
+RAW_TEXT_END_RE = {tag: re.compile(f'</{tag}[\\s>]', re.I) for tag in RAW_TEXT_TAGS}
+
+@functools.lru_cache(maxsize=256)
+def highlight_pattern(keywords):
+    keywords = sorted({k.strip() for k in keywords if k and k.strip()}, key=len, reverse=True)
+    if not keywords:
+        return None
+    # Entities come first so that matching skips over them as a whole
+    return re.compile('|'.join([HTML_ENTITY_RE] + [re.escape(k) for k in keywords]), re.IGNORECASE)
+
+def mark_keyword(match):
+    if match.group('entity'):
+        return match.group(0)
+    return f'<mark class="custom-highlight">{match.group(0)}</mark>'
+
+def rewrite_html(html, keywords, base_url):
+    pattern = highlight_pattern(tuple(keywords))
+    out = []
+    pos = 0
+    while True:
+        tag = HTML_TAG_RE.search(html, pos)
+        text = html[pos:tag.start() if tag else len(html)]
+        out.append(pattern.sub(mark_keyword, text) if pattern and text else text)
+        if not tag:
+            break
+
+        closing, name = tag.group(1), (tag.group(2) or '').lower()
+        markup = tag.group(0)
+        if name and not closing:
+            markup = ROOT_RELATIVE_ATTR_RE.sub(lambda m: f"{m.group(1)}{base_url}/", markup)
+        out.append(markup)
+        pos = tag.end()
+
+        if name in RAW_TEXT_TAGS and not closing and not markup.endswith('/>'):
+            end = RAW_TEXT_END_RE[name].search(html, pos)
+            end = end.start() if end else len(html)
+            out.append(html[pos:end])
+            pos = end
+    return ''.join(out)
+
+# --- Reader Mode ---
+# Readability-style article extraction: paragraphs score their parent and
+# grandparent by text length and commas, candidates are weighted by tag and
+# class/id hints and penalized by link density, and the best candidate plus
+# related siblings becomes the article. Results are cached per URL and body
+# hash, so toggling reader mode or paging back and forth is a dict lookup.
+
+app.config['READER_CACHE_ENTRIES'] = int(os.environ.get('READER_CACHE_ENTRIES', 256))
+
+READER_UNLIKELY_RE = re.compile(r'comment|combx|disqus|foot|header|menu|meta|nav|rss|shoutbox|sidebar|sponsor|'
+                                r'social|share|cookie|consent|banner|popup|promo|related|advert|breadcrumb|pagination', re.I)
+READER_POSITIVE_RE = re.compile(r'article|body|content|entry|main|page|post|text|blog|story', re.I)
+READER_NEGATIVE_RE = re.compile(r'combx|comment|contact|foot|footer|footnote|link|media|meta|promo|related|'
+                                r'scroll|shoutbox|sidebar|sponsor|tags|widget|share|social', re.I)
+READER_CLUTTER_TAGS = ['script', 'style', 'nav', 'header', 'footer', 'aside', 'iframe', 'noscript', 'form',
+                       'button', 'input', 'select', 'svg', 'canvas', 'object', 'embed']
+READER_TAG_WEIGHTS = {'article': 10, 'main': 10, 'div': 5, 'section': 3, 'pre': 3, 'td': 3, 'blockquote': 3,
+                      'address': -3, 'ol': -3, 'ul': -3, 'dl': -3, 'dd': -3, 'dt': -3, 'li': -3,
+                      'h1': -5, 'h2': -5, 'h3': -5, 'h4': -5, 'h5': -5, 'h6': -5, 'th': -5}
+
+reader_cache = OrderedDict()
+reader_cache_lock = threading.Lock()
+
+def class_weight(tag):
+    hints = ' '.join(tag.get('class') or []) + ' ' + (tag.get('id') or '')
+    weight = 0
+    if READER_NEGATIVE_RE.search(hints):
+        weight -= 25
+    if READER_POSITIVE_RE.search(hints):
+        weight += 25
+    return weight
+
+def link_density(tag):
+    text_length = len(tag.get_text(strip=True))
+    if not text_length:
+        return 0
+    link_length = sum(len(a.get_text(strip=True)) for a in tag.find_all('a'))
+    return link_length / text_length
+
+def extract_article(html):
+    """Returns (title, article html) for the main content of a page."""
+    soup = parse_html(html)
+    title = soup.title.get_text(strip=True) if soup.title else ''
+
+    for tag in soup(READER_CLUTTER_TAGS):
+        tag.decompose()
+    for tag in soup.find_all(True):
+        if tag.decomposed or tag.name in ('html', 'body', 'article', 'main'):
+            continue
+        hints = ' '.join(tag.get('class') or []) + ' ' + (tag.get('id') or '')
+        if READER_UNLIKELY_RE.search(hints) and not READER_POSITIVE_RE.search(hints):
+            tag.decompose()
+
+    scores = {}
+    for paragraph in soup.find_all(['p', 'pre', 'td']):
+        text = paragraph.get_text(' ', strip=True)
+        if len(text) < 25:
+            continue
+        score = 1 + text.count(',') + text.count('，') + min(len(text) // 100, 3)
+        for ancestor, share in ((paragraph.parent, 1), (paragraph.parent and paragraph.parent.parent, 0.5)):
+            if ancestor is None or ancestor.name in (None, '[document]'):
+                continue
+            if id(ancestor) not in scores:
+                scores[id(ancestor)] = [ancestor, READER_TAG_WEIGHTS.get(ancestor.name, 0) + class_weight(ancestor)]
+            scores[id(ancestor)][1] += score * share
+
+    body = soup.body or soup
+    if not scores:
+        return title, body.decode_contents()
+
+    candidates = [(tag, score * (1 - link_density(tag))) for tag, score in scores.values()]
+    top, top_score = max(candidates, key=lambda c: c[1])
+    final_scores = {id(tag): score for tag, score in candidates}
+
+    # Pull in siblings that look like part of the same article
+    threshold = max(10, top_score * 0.2)
+    parts = []
+    siblings = top.parent.find_all(recursive=False) if top.parent else [top]
+    for sibling in siblings:
+        if sibling is top or final_scores.get(id(sibling), 0) >= threshold:
+            parts.append(sibling)
+        elif sibling.name == 'p':
+            text = sibling.get_text(' ', strip=True)
+            density = link_density(sibling)
+            if (len(text) > 80 and density < 0.25) or (text and density == 0 and re.search(r'\.( |$)', text)):
+                parts.append(sibling)
+
+    for part in parts:
+        for tag in [part] + part.find_all(True):
+            for attr in ('class', 'style', 'id', 'width', 'height', 'align'):
+                if attr in tag.attrs:
+                    del tag[attr]
+    return title, ''.join(str(part) for part in parts)
+
+def get_reader_article(url, html):
+    key = (url, hashlib.sha256(html.encode('utf-8', errors='replace')).hexdigest())
+    with reader_cache_lock:
+        if key in reader_cache:
+            reader_cache.move_to_end(key)
+            inc('cache_requests_total', cache='reader', result='hit')
+            return reader_cache[key]
+    inc('cache_requests_total', cache='reader', result='miss')
+
+    title, article = extract_article(html)
+    heading = f"<h1>{escape(title)}</h1>" if title else ''
+    content = f"""
+                    <div style="max-width: 800px; margin: 0 auto; padding: 40px; font-family: 'Inter', sans-serif; line-height: 1.6; font-size: 18px; color: #333; background: #fff;">
+                        {heading}
+                        {article}
+                    </div>
+                    """
+    with reader_cache_lock:
+        reader_cache[key] = content
+        while len(reader_cache) > app.config['READER_CACHE_ENTRIES']:
+            reader_cache.popitem(last=False)
+    return content
+
+def prefetch_reader_article(url, headers):
+    try:
+        get_reader_article(url, fetch_page(url, headers, 8, app.config['PROXY_MAX_BYTES']).text)
+    except Exception as e:
+        print(f"Reader prefetch for {url} failed: {e}")
+
+# --- Proxy Output Cache ---
+# Rendered /proxy pages are kept in memory (LRU, bounded by
+# PROXY_CACHE_MAX_BYTES) keyed by URL, keywords, reader flag, project and the
+# upstream body hash, together with their gzip/br variants, so repeat views
+# skip fetching, extraction, highlighting and compression altogether.
+
+app.config['PROXY_MAX_BYTES'] = int(os.environ.get('PROXY_MAX_BYTES', 5 * 1024 * 1024))
+app.config['PROXY_BUDGET'] = float(os.environ.get('PROXY_BUDGET', 12))
+app.config['PROXY_CACHE_MAX_BYTES'] = int(os.environ.get('PROXY_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ETAG_ENCODING_SUFFIXES = {'gzip': 'gz', 'br': 'br'}
+
+rendered_cache = OrderedDict()
+rendered_cache_size = 0
+rendered_cache_lock = threading.Lock()
+
+def get_rendered_page(key):
+    with rendered_cache_lock:
+        variants = rendered_cache.get(key)
+        if variants is not None:
+            rendered_cache.move_to_end(key)
+    inc('cache_requests_total', cache='rendered', result='hit' if variants is not None else 'miss')
+    return variants
+
+def trim_rendered_cache():
+    global rendered_cache_size
+    while rendered_cache_size > app.config['PROXY_CACHE_MAX_BYTES'] and len(rendered_cache) > 1:
+        _, evicted = rendered_cache.popitem(last=False)
+        rendered_cache_size -= sum(len(v) for v in evicted.values())
+
+def store_rendered_page(key, body):
+    global rendered_cache_size
+    variants = {'identity': body}
+    with rendered_cache_lock:
+        if key in rendered_cache:
+            return rendered_cache[key]
+        rendered_cache[key] = variants
+        rendered_cache_size += len(body)
+        trim_rendered_cache()
+    return variants
+
+def choose_content_encoding(accept_encodings):
+    if brotli is not None and accept_encodings['br']:
+        return 'br'
+    if accept_encodings['gzip']:
+        return 'gzip'
+    return 'identity'
+
+def encoded_etag(etag, encoding):
+    """Each encoding is a different byte sequence, so it gets its own strong ETag."""
+    return etag if encoding == 'identity' else f"{etag}-{ETAG_ENCODING_SUFFIXES[encoding]}"
+
+def compress_body(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=5)
+    return gzip.compress(body, compresslevel=6)
+
+def compressed_variant(key, variants, encoding):
+    global rendered_cache_size
+    body = variants.get(encoding)
+    if body is None:
+        body = compress_body(variants['identity'], encoding)
+        with rendered_cache_lock:
+            if encoding not in variants:
+                variants[encoding] = body
+                if rendered_cache.get(key) is variants:
+                    rendered_cache_size += len(body)
+                    trim_rendered_cache()
+    return body
+
+def render_proxy_page(url, response, keywords, project_name, reader_mode, headers):
+    with projects_lock:
+        projects = load_projects_from_disk()
+        project_urls = list(projects.get(project_name, {}).get('urls', []))
+
+    # Reader Mode Processing
+    content = response.text
+    if reader_mode == 'true':
+        try:
+            content = get_reader_article(url, content)
+        except Exception as e:
+            print(f"Reader mode failed: {e}")
+
+    # Sidebar & Navigation Logic
+    reader_btn_text = "📖 Reader Modus: AN" if reader_mode == 'true' else "👁️ Reader Modus: AUS"
+    new_reader_state = 'false' if reader_mode == 'true' else 'true'
+
+    current_index = -1
+    try:
+         current_index = project_urls.index(url)
+    except: pass
+
+    prev_url = project_urls[current_index - 1] if current_index > 0 else None
+    next_url = project_urls[current_index + 1] if current_index < len(project_urls) - 1 else None
+    if reader_mode == 'true':
+        # Paging through the project in reader mode should not wait on the network
+        for neighbour in (prev_url, next_url):
+            if neighbour and 'google.' not in neighbour:
+                fetch_engine.submit(neighbour, prefetch_reader_article, neighbour, headers)
+
+    safe_keywords = quote(",".join(keywords))
+    safe_project = quote(project_name)
+
+    # Injection for Selection Bar and Highlight Bar inside the iframe
+    injection = f"""
+    <style>
+        @import url('https://fonts.googleapis.com/css2?family=Inter:wght@400;700;800&display=swap');
+
+        .custom-highlight {{
+            background-color: #ffeb3b !important;
+            color: #000 !important;
+            padding: 2px 0;
+            box-shadow: 0 0 5px rgba(0,0,0,0.3);
+            border-radius: 2px;
+            font-weight: bold;
+            display: inline;
+        }}
+
+        body {{ 
+            margin: 0 !important; 
+            width: 100% !important;
+            position: relative;
+        }}
+    </style>
+
+    <script>
+        let selectedText = '';
+        document.addEventListener('mouseup', function() {{
+            const selection = window.getSelection().toString().trim();
+            if (selection.length > 0) {{
+                selectedText = selection;
+                window.parent.postMessage({{ action: 'textSelected', hasSelection: true }}, '*');
+            }} else {{
+                window.parent.postMessage({{ action: 'textSelected', hasSelection: false }}, '*');
+            }}
+        }});
+
+        // Listen for save trigger from parent header
+        window.addEventListener('message', function(event) {{
+            if (event.data.action === 'triggerSave') {{
+                const projectName = "{project_name}";
+                const currentUrl = "{url}";
+
+                if (!selectedText) return;
+
+                fetch('/add_note', {{
+                    method: 'POST',
+                    headers: {{'Content-Type': 'application/json'}},
+                    body: JSON.stringify({{
+                        project: projectName,
+                        text: selectedText,
+                        url: currentUrl,
+                        title: document.title
+                    }})
+                }}).then(r => r.json()).then(data => {{
+                    if (data.status === 'success') {{
+                        window.parent.postMessage({{ action: 'saveDone' }}, '*');
+                    }}
+                }});
+            }}
+        }});
+
+        document.addEventListener('keydown', function(e) {{
+            if (e.ctrlKey && e.key === 'Enter') {{
+                window.parent.postMessage({{ action: 'triggerSave' }}, '*');
+            }}
+        }});
+    </script>
+    """
+
+    effective_keywords = []
+    if reader_mode != 'true' and 'google.' not in url:
+        effective_keywords = keywords
+
+    base_url = f"{response.url.split('://')[0]}://{response.url.split('://')[1].split('/')[0]}"
+    with span('highlight'):
+        content = rewrite_html(content, effective_keywords, base_url)
+
+    return content + injection
+
 @app.route('/proxy')
 def proxy():
     url = request.args.get('url')
@@ -468,157 +3640,116 @@ def proxy():
             'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7',
             'Accept-Language': 'de-DE,de;q=0.9,en-US;q=0.8,en;q=0.7',
         }
-        response = requests.get(url, headers=headers, timeout=8, allow_redirects=True)
-        response.raise_for_status()
-        
-        projects = load_projects_from_disk()
-        project_urls = projects.get(project_name, {}).get('urls', [])
+        deadline = time.time() + app.config['PROXY_BUDGET']
+        future = fetch_engine.submit(url, fetch_page, url, headers, 8, app.config['PROXY_MAX_BYTES'], deadline)
+        try:
+            response = future.result(timeout=app.config['PROXY_BUDGET'])
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise FetchTimeout(f"No answer within {app.config['PROXY_BUDGET']:g}s")
         
-        # Reader Mode Processing
-        content = response.text
-        if reader_mode == 'true':
-            try:
-                soup = BeautifulSoup(content, 'html.parser')
-                # Strip clutter
-                for tag in soup(['nav', 'header', 'footer', 'aside', 'script', 'style', 'iframe', 'noscript', 'form']):
-                    tag.decompose()
-                
-                # Unwrap main content to ensure visibility if container was hidden
-                body = soup.find('body')
-                if body:
-                    # Very simple text extraction/cleaning
-                    # In a real reader mode we'd algorithmically find the article, 
-                    # but here we just clean the body
-                    for tag in body.find_all(True):
-                        del tag['class']
-                        del tag['style']
-                    
-                    content = str(body)
-                    # Add simple readable style
-                    content = f"""
-                    <div style="max-width: 800px; margin: 0 auto; padding: 40px; font-family: 'Inter', sans-serif; line-height: 1.6; font-size: 18px; color: #333; background: #fff;">
-                        {content}
-                    </div>
-                    """
-            except Exception as e:
-                print(f"Reader mode failed: {e}")
-
-        # Sidebar & Navigation Logic
-        reader_btn_text = "📖 Reader Modus: AN" if reader_mode == 'true' else "👁️ Reader Modus: AUS"
-        new_reader_state = 'false' if reader_mode == 'true' else 'true'
+        # The upstream body hash is the validator: same page + same options = same output
+        cache_key = (url, tuple(keywords), reader_mode, project_name, response.digest)
+        encoding = choose_content_encoding(request.accept_encodings)
+        etag = encoded_etag(hashlib.sha1(repr(cache_key).encode('utf-8')).hexdigest(), encoding)
+        if request.if_none_match.contains(etag):
+            return Response(status=304, headers={'ETag': f'"{etag}"', 'Vary': 'Accept-Encoding'})
         
-        current_index = -1
-        try:
-             current_index = project_urls.index(url)
-        except: pass
+        rendered = get_rendered_page(cache_key)
+        if rendered is None:
+            html = render_proxy_page(url, response, keywords, project_name, reader_mode, headers)
+            rendered = store_rendered_page(cache_key, html.encode('utf-8'))
         
-        prev_url = project_urls[current_index - 1] if current_index > 0 else None
-        next_url = project_urls[current_index + 1] if current_index < len(project_urls) - 1 else None
-
-        safe_keywords = quote(",".join(keywords))
-        safe_project = quote(project_name)
-
-        # Injection for Selection Bar and Highlight Bar inside the iframe
-        injection = f"""
-        <style>
-            @import url('https://fonts.googleapis.com/css2?family=Inter:wght@400;700;800&display=swap');
-            
-            .custom-highlight {{
-                background-color: #ffeb3b !important;
-                color: #000 !important;
-                padding: 2px 0;
-                box-shadow: 0 0 5px rgba(0,0,0,0.3);
-                border-radius: 2px;
-                font-weight: bold;
-                display: inline;
-            }}
-
-            body {{ 
-                margin: 0 !important; 
-                width: 100% !important;
-                position: relative;
-            }}
-        </style>
-
-        <script>
-            let selectedText = '';
-            document.addEventListener('mouseup', function() {{
-                const selection = window.getSelection().toString().trim();
-                if (selection.length > 0) {{
-                    selectedText = selection;
-                    window.parent.postMessage({{ action: 'textSelected', hasSelection: true }}, '*');
-                }} else {{
-                    window.parent.postMessage({{ action: 'textSelected', hasSelection: false }}, '*');
-                }}
-            }});
-
-            // Listen for save trigger from parent header
-            window.addEventListener('message', function(event) {{
-                if (event.data.action === 'triggerSave') {{
-                    const projectName = "{project_name}";
-                    const currentUrl = "{url}";
-                    
-                    if (!selectedText) return;
-
-                    fetch('/add_note', {{
-                        method: 'POST',
-                        headers: {{'Content-Type': 'application/json'}},
-                        body: JSON.stringify({{
-                            project: projectName,
-                            text: selectedText,
-                            url: currentUrl,
-                            title: document.title
-                        }})
-                    }}).then(r => r.json()).then(data => {{
-                        if (data.status === 'success') {{
-                            window.parent.postMessage({{ action: 'saveDone' }}, '*');
-                        }}
-                    }});
-                }}
-            }});
-
-            document.addEventListener('keydown', function(e) {{
-                if (e.ctrlKey && e.key === 'Enter') {{
-                    window.parent.postMessage({{ action: 'triggerSave' }}, '*');
-                }}
-            }});
-        </script>
-        """
-
-        if reader_mode != 'true':
-            effective_keywords = [] if 'google.' in url else keywords
-            for kw in effective_keywords:
-                if not kw or not kw.strip(): continue
-                clean_kw = kw.strip()
-                pattern = re.compile(f'(?i)(?![^<]*>){re.escape(clean_kw)}')
-                content = pattern.sub(f'<mark class="custom-highlight">{clean_kw}</mark>', content)
-
-        base_url = f"{response.url.split('://')[0]}://{response.url.split('://')[1].split('/')[0]}"
-        content = content.replace('src="/', f'src="{base_url}/')
-        content = content.replace('href="/', f'href="{base_url}/')
-
-        return content + injection
+        return Response(compressed_variant(cache_key, rendered, encoding), mimetype='text/html', headers={
+            'ETag': f'"{etag}"',
+            'Vary': 'Accept-Encoding',
+            'Cache-Control': 'private, no-cache',
+            **({'Content-Encoding': encoding} if encoding != 'identity' else {})
+        })
 
+    except requests.Timeout as e:
+        return f"Error loading page: {str(e)}", 504
+    except HostUnavailable as e:
+        return f"Error loading page: {str(e)}", 503
     except Exception as e:
         return f"Error loading page: {str(e)}", 500
 
+@app.route('/metrics')
+def metrics():
+    with change_feed_lock:
+        stream_subscribers = len(subscribers)
+    with projects_lock:
+        project_count = len(projects_state)
+        note_count = sum(len(p.get('notes', [])) for p in projects_state.values())
+    store_bytes = sum(os.path.getsize(path) for path in (PROJECTS_DB, PROJECTS_DB + '-wal') if os.path.exists(path))
+    with fetch_engine.lock:
+        fetch_active = sum(fetch_engine.active.values())
+        fetch_waiting = sum(len(q) for q in fetch_engine.waiting.values())
+    with crawl_engine.lock:
+        crawl_waiting = sum(len(q) for q in crawl_engine.waiting.values())
+    with circuit_breakers_lock:
+        circuits_open = sum(breaker.is_open for breaker in circuit_breakers.values())
+    gauges = [
+        ('stream_subscribers', 'Open /stream connections.', stream_subscribers),
+        ('projects', 'Projects in the store.', project_count),
+        ('notes', 'Notes in the store.', note_count),
+        ('store_bytes', 'Size of the SQLite project store including its WAL.', store_bytes),
+        ('store_generation', 'Changes made to the store since startup.', projects_generation),
+        ('page_cache_bytes', 'Bytes of the blobs referenced by the page cache index.', page_cache_bytes),
+        ('rendered_cache_bytes', 'Bytes held by the rendered /proxy page cache.', rendered_cache_size),
+        ('api_cache_bytes', 'Bytes held by the read API response cache.', api_cache_size),
+        ('fetch_active', 'Running fetch engine jobs.', fetch_active),
+        ('fetch_waiting', 'Fetch engine jobs waiting for a host slot.', fetch_waiting),
+        ('crawl_waiting', 'Crawl jobs waiting for a host slot.', crawl_waiting),
+        ('circuits_open', 'Hosts currently skipped by their circuit breaker.', circuits_open),
+    ]
+    return Response(render_metrics(gauges), mimetype='text/plain; version=0.0.4')
+
+@app.route('/crawl/status')
+def crawl_status():
+    project_name = request.args.get('project')
+    with projects_lock:
+        if project_name not in load_projects_from_disk():
+            return jsonify({'error': 'Project not found'}), 404
+    return jsonify(crawler.status(project_name))
+
 @app.route('/stream')
 def stream():
+    project_name = request.args.get('project') or None
+    last_id = parse_event_id(request.headers.get('Last-Event-ID', request.args.get('last_event_id')))
+    
+    sub, replay, snapshot_id = subscribe(project_name, last_id)
+    if replay is None:
+        if project_name:
+            with projects_lock:
+                data = json.dumps(load_projects_from_disk().get(project_name))
+        else:
+            data = get_projects_json()
+        snapshot = f'{{"type": "snapshot", "project": {json.dumps(project_name)}, "data": {data}}}'
+        replay = [(snapshot_id, project_name, snapshot)]
+    
     def event_stream():
-        last_mtime = 0
-        while True:
-            if os.path.exists(PROJECTS_FILE):
+        try:
+            for event_id, _, payload in replay:
+                yield f"id: {format_event_id(event_id)}\ndata: {payload}\n\n"
+            while True:
                 try:
-                    mtime = os.path.getmtime(PROJECTS_FILE)
-                    if mtime > last_mtime:
-                        last_mtime = mtime
-                        projects = load_projects_from_disk()
-                        yield f"data: {json.dumps(projects)}\n\n"
-                except OSError:
-                    pass
-            time.sleep(0.5)
-    return Response(event_stream(), mimetype="text/event-stream")
+                    event_id, _, payload = sub.queue.get(timeout=app.config['STREAM_HEARTBEAT'])
+                    if event_id is None:
+                        yield f"data: {payload}\n\n"
+                    else:
+                        yield f"id: {format_event_id(event_id)}\ndata: {payload}\n\n"
+                except queue.Empty:
+                    yield ": heartbeat\n\n"
+        finally:
+            unsubscribe(sub)
+    return Response(event_stream(), mimetype="text/event-stream",
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=9999)
+    # Turn SIGTERM (docker stop) into a normal exit so the atexit flush runs. The
+    # debug reloader serves from a child process that its parent kills on SIGTERM
+    # before the child can flush, so the container runs with FLASK_DEBUG=0.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    app.run(debug=os.environ.get('FLASK_DEBUG', '1') == '1', host='0.0.0.0', port=9999)
 
@@ -0,0 +1,83 @@
+"""Parse + text extraction throughput per HTML backend.
+
+Runs every text extractor available in app.TEXT_EXTRACTORS over a corpus of
+saved HTML pages and reports pages/s and MB/s. By default the corpus is the
+page cache (data/page_cache), i.e. the pages L8teSearch has already fetched.
+
+    python benchmarks/bench_parsers.py [CORPUS_DIR] [--repeat N] [--json]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+
+
+def load_corpus(folder):
+    pages = []
+    for root, _, files in os.walk(folder):
+        for filename in files:
+            if filename.endswith(('.json', '.tmp')):
+                continue
+            with open(os.path.join(root, filename), 'rb') as f:
+                content = f.read()
+            if b'<' in content[:2048]:
+                pages.append(content.decode('utf-8', errors='replace'))
+    return pages
+
+
+def legacy_normalize(text):
+    lines = (line.strip() for line in text.splitlines())
+    chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
+    return '\n'.join(chunk for chunk in chunks if chunk)
+
+
+def run(name, fn, pages, repeat):
+    total_bytes = sum(len(p.encode('utf-8')) for p in pages) * repeat
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for page in pages:
+            fn(page)
+    elapsed = time.perf_counter() - started
+    return {
+        'backend': name,
+        'pages': len(pages) * repeat,
+        'seconds': round(elapsed, 4),
+        'pages_per_s': round(len(pages) * repeat / elapsed, 1),
+        'mb_per_s': round(total_bytes / elapsed / 1e6, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('corpus', nargs='?', default=app.PAGE_CACHE_FOLDER)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    pages = load_corpus(args.corpus)
+    if not pages:
+        sys.exit(f"No HTML pages found in {args.corpus}")
+
+    results = [run(name, fn, pages, args.repeat) for name, fn in app.TEXT_EXTRACTORS.items()]
+
+    texts = [app.parse_html(p).get_text() for p in pages]
+    results.append(run('normalize (legacy)', legacy_normalize, texts, args.repeat))
+    results.append(run('normalize', app.normalize_text, texts, args.repeat))
+
+    if args.json:
+        print(json.dumps({'corpus': args.corpus, 'default': app.app.config['HTML_PARSER'], 'results': results}, indent=2))
+        return
+
+    print(f"{len(pages)} pages from {args.corpus}, default backend: {app.app.config['HTML_PARSER']}")
+    print(f"{'backend':<20} {'pages':>7} {'seconds':>9} {'pages/s':>9} {'MB/s':>7}")
+    for r in results:
+        print(f"{r['backend']:<20} {r['pages']:>7} {r['seconds']:>9} {r['pages_per_s']:>9} {r['mb_per_s']:>7}")
+
+
+if __name__ == '__main__':
+    main()
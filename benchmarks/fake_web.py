@@ -0,0 +1,112 @@
+"""Local stand-in for the web, for benchmarks.
+
+Serves synthetic HTML pages under /page/<anything>.html (content derived from
+the path, so every run sees the same pages) or, with --pages, the files of a
+directory of saved HTML. Latency, page size and the share of failing
+requests are configurable; failures answer 500 or hang up without a reply.
+
+    python benchmarks/fake_web.py [--port 8765] [--latency MS] [--jitter MS]
+        [--size KB] [--fail-rate 0.0] [--pages DIR]
+"""
+import argparse
+import hashlib
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from generate_projects import WORDS
+
+
+def synthetic_page(path, size_kb):
+    rng = random.Random(hashlib.sha256(path.encode('utf-8')).digest())
+    title = ' '.join(rng.choice(WORDS) for _ in range(4)).title()
+    parts = [
+        f"<!DOCTYPE html><html><head><meta charset='utf-8'><title>{title}</title>"
+        "<style>body{font-family:sans-serif}</style><script>var tracking = 1;</script></head><body>"
+        f"<nav class='menu'><a href='/'>Start</a> <a href='/impressum'>Impressum</a></nav>"
+        f"<article><h1>{title}</h1>"
+    ]
+    size = sum(map(len, parts))
+    while size < size_kb * 1024:
+        paragraph = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(40, 90)))
+        chunk = f"<p>{paragraph.capitalize()}.</p>"
+        parts.append(chunk)
+        size += len(chunk)
+    parts.append("</article><footer class='footer'>© Fake Web</footer></body></html>")
+    return ''.join(parts).encode('utf-8')
+
+
+class FakeWebHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    config = {}
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        config = self.config
+        delay = config['latency'] + random.uniform(0, config['jitter'])
+        if delay:
+            time.sleep(delay / 1000)
+
+        if random.random() < config['fail_rate']:
+            if random.random() < 0.5:
+                self.close_connection = True
+                return
+            self.send_error(500)
+            return
+
+        path = self.path.split('?')[0]
+        body = None
+        if config['pages']:
+            file_path = os.path.join(config['pages'], os.path.basename(path))
+            if os.path.isfile(file_path):
+                with open(file_path, 'rb') as f:
+                    body = f.read()
+        elif path.startswith('/page/'):
+            body = synthetic_page(path, config['size'])
+        if body is None:
+            self.send_error(404)
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', '"%s"' % hashlib.sha1(body).hexdigest())
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_server(port=8765, latency=0, jitter=0, size=50, fail_rate=0.0, pages=None):
+    """Starts the server on a daemon thread and returns it (call .shutdown() to stop)."""
+    handler = type('Handler', (FakeWebHandler,), {'config': {
+        'latency': latency, 'jitter': jitter, 'size': size, 'fail_rate': fail_rate, 'pages': pages,
+    }})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='fake-web', daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0, help='fixed delay per request in ms')
+    parser.add_argument('--jitter', type=float, default=0, help='extra random delay up to this many ms')
+    parser.add_argument('--size', type=int, default=50, help='synthetic page size in KB')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='share of requests that fail')
+    parser.add_argument('--pages', help='serve saved HTML files from this directory instead')
+    args = parser.parse_args()
+
+    server = start_server(args.port, args.latency, args.jitter, args.size, args.fail_rate, args.pages)
+    print(f"Fake web on http://127.0.0.1:{args.port}/page/<name>.html (Ctrl+C to stop)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
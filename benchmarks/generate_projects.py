@@ -0,0 +1,74 @@
+"""Synthetic projects.json generator.
+
+Writes N projects with U URLs and M notes each. URLs point at the fake web
+server (benchmarks/fake_web.py) so searches and the proxy never leave the
+machine. The output is fully determined by --seed.
+
+    python benchmarks/generate_projects.py OUT.json [--projects N] [--urls U] [--notes M]
+        [--base-url http://127.0.0.1:8765] [--seed S]
+"""
+import argparse
+import json
+import random
+
+WORDS = (
+    'aufklärung vernunft toleranz lessing wieland goethe schiller kant freiheit '
+    'bildung literatur epoche drama roman gedicht theater kritik gesellschaft '
+    'religion naturrecht publikum zeitschrift briefwechsel übersetzung '
+    'klimawandel energie emissionen netzwerk software datenbank prozessor '
+    'medizin therapie klinik diagnose mannschaft trainer stadion tabelle'
+).split()
+
+CATEGORIES = ['Unsortiert', 'Quellen', 'Zitate', 'Bilder', 'Thema: Aufklärung']
+
+
+def sentence(rng, length):
+    return ' '.join(rng.choice(WORDS) for _ in range(length)).capitalize() + '.'
+
+
+def make_note(rng, n, urls):
+    note = {
+        'id': f"bench-{n}",
+        'text': ' '.join(sentence(rng, rng.randint(6, 18)) for _ in range(rng.randint(1, 4))),
+        'url': rng.choice(urls) if urls else None,
+        'title': sentence(rng, rng.randint(2, 6))[:-1],
+        'date': f"2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d} {rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}",
+        'category': rng.choice(CATEGORIES),
+    }
+    if rng.random() < 0.2:
+        note['tags'] = rng.sample(WORDS, rng.randint(1, 3))
+    return note
+
+
+def generate(projects, urls, notes, base_url, seed=0):
+    rng = random.Random(seed)
+    result = {}
+    for p in range(projects):
+        project_urls = [f"{base_url}/page/{p}-{u}.html" for u in range(urls)]
+        result[f"Projekt {p}"] = {
+            'urls': project_urls,
+            'keywords': ', '.join(rng.sample(WORDS, 3)),
+            'notes': [make_note(rng, n, project_urls) for n in range(notes)],
+            'mindmap': [{'id': 1, 'title': 'Hauptthema', 'notes': '', 'urls': project_urls[:3], 'children': []}],
+        }
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('out')
+    parser.add_argument('--projects', type=int, default=5)
+    parser.add_argument('--urls', type=int, default=20)
+    parser.add_argument('--notes', type=int, default=1000)
+    parser.add_argument('--base-url', default='http://127.0.0.1:8765')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    projects = generate(args.projects, args.urls, args.notes, args.base_url, args.seed)
+    with open(args.out, 'w') as f:
+        json.dump(projects, f, ensure_ascii=False)
+    print(f"Wrote {args.projects} projects x {args.urls} URLs x {args.notes} notes to {args.out}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,430 @@
+"""End-to-end endpoint benchmarks against a synthetic workload.
+
+Generates projects (generate_projects.py) into a scratch data folder, starts
+the fake web server (fake_web.py) and drives the Flask app in-process with
+its test client from --concurrency threads. The background crawler is given
+time to pre-fetch the project URLs first, as it would in real use. Write
+scenarios wait for the store flush, so their latency includes persistence.
+Reports latency percentiles, throughput and, per scenario, the peak RSS
+sampled while it ran and how much RSS grew over it; --json output can be
+diffed across versions.
+
+    python benchmarks/run_scenarios.py [--projects N] [--urls U] [--notes M]
+        [--requests R] [--concurrency C] [--latency MS] [--size KB]
+        [--fail-rate F] [--scenarios a,b,...] [--json] [--out FILE]
+"""
+import argparse
+import atexit
+import concurrent.futures
+import functools
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from fake_web import start_server  # noqa: E402
+from generate_projects import WORDS, generate  # noqa: E402
+
+
+def current_rss_mb():
+    """Resident set size right now (Linux only, None elsewhere)."""
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+
+
+class RssSampler:
+    """Samples RSS on a thread while a scenario runs."""
+
+    def __init__(self, interval=0.02):
+        self.interval = interval
+        self.stop = threading.Event()
+        self.before = self.after = self.peak = None
+
+    def _run(self):
+        while not self.stop.wait(self.interval):
+            rss = current_rss_mb()
+            if rss is not None:
+                self.peak = max(self.peak or 0, rss)
+
+    def __enter__(self):
+        self.before = self.peak = current_rss_mb()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop.set()
+        self.thread.join()
+        self.after = current_rss_mb()
+        if self.after is not None:
+            self.peak = max(self.peak or 0, self.after)
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+class Workload:
+    """What the scenarios pick their parameters from; one RNG per thread."""
+
+    def __init__(self, app_module, seed):
+        self.app = app_module
+        self.seed = seed
+        self.local = threading.local()
+        with app_module.projects_lock:
+            self.projects = {name: list(p.get('urls', [])) for name, p in app_module.projects_state.items()}
+        self.names = sorted(self.projects)
+
+    @property
+    def rng(self):
+        if not hasattr(self.local, 'rng'):
+            self.local.rng = random.Random(f"{self.seed}-{threading.get_ident()}")
+        return self.local.rng
+
+    @property
+    def client(self):
+        if not hasattr(self.local, 'client'):
+            self.local.client = self.app.app.test_client()
+        return self.local.client
+
+    def project(self):
+        return self.rng.choice(self.names)
+
+    def keywords(self, n=2):
+        return self.rng.sample(WORDS, n)
+
+    def note_id(self, project):
+        with self.app.projects_lock:
+            notes = self.app.projects_state.get(project, {}).get('notes', [])
+            return self.rng.choice(notes)['id'] if notes else None
+
+
+def get_projects(w, i):
+    return w.client.get('/projects').status_code
+
+
+def get_project(w, i):
+    return w.client.get(f"/projects/{w.project()}", query_string={'fields': 'urls,keywords,mindmap'},
+                        headers={'Accept-Encoding': 'gzip'}).status_code
+
+
+def notes_page(w, i):
+    """Walks a project's notes page by page, as a client listing them would."""
+    project = w.project()
+    cursor = None
+    while True:
+        response = w.client.get(f"/projects/{project}/notes", query_string={'cursor': cursor or ''})
+        cursor = response.get_json()['next_cursor']
+        if response.status_code != 200 or not cursor:
+            return response.status_code
+
+
+def search(w, i):
+    project = w.project()
+    return w.client.post('/search', json={
+        'urls': w.projects[project], 'keywords': w.keywords(), 'project': project
+    }).status_code
+
+
+def search_stream(w, i):
+    project = w.project()
+    response = w.client.post('/search/stream', json={
+        'urls': w.projects[project], 'keywords': w.keywords(), 'project': project
+    })
+    response.get_data()
+    return response.status_code
+
+
+def note_search(w, i):
+    """Type-ahead: two words, the second one half typed."""
+    first, second = w.keywords()
+    query = f"{first} {second[:w.rng.randint(1, len(second))]}"
+    project = w.project() if w.rng.random() < 0.8 else ''
+    return w.client.get('/search/notes', query_string={'q': query, 'project': project}).status_code
+
+
+def proxy(w, i, reader=False):
+    project = w.project()
+    response = w.client.get('/proxy', query_string={
+        'url': w.rng.choice(w.projects[project]),
+        'keywords': ','.join(w.keywords()),
+        'project': project,
+        'reader': 'true' if reader else 'false',
+    }, headers={'Accept-Encoding': 'gzip'})
+    return response.status_code
+
+
+def proxy_reader(w, i):
+    return proxy(w, i, reader=True)
+
+
+def stream_connect(w, i):
+    """Time until the first event (the snapshot) of a /stream subscription."""
+    response = w.client.get('/stream', query_string={'project': w.project()}, buffered=False)
+    try:
+        next(iter(response.response))
+    finally:
+        response.close()
+    return response.status_code
+
+
+def persisted(fn):
+    """Times a write scenario up to its store flush, not just the response."""
+    @functools.wraps(fn)
+    def wrapper(w, i):
+        status = fn(w, i)
+        w.app.flush_projects()
+        return status
+    return wrapper
+
+
+@persisted
+def add_note(w, i):
+    return w.client.post('/add_note', json={
+        'project': w.project(), 'text': ' '.join(w.keywords(12)), 'url': None, 'title': 'Benchmark'
+    }).status_code
+
+
+@persisted
+def edit_note(w, i):
+    project = w.project()
+    return w.client.post('/edit_note', json={
+        'project': project, 'id': w.note_id(project), 'text': ' '.join(w.keywords(12))
+    }).status_code
+
+
+@persisted
+def move_note(w, i):
+    project = w.project()
+    return w.client.post('/move_note', json={
+        'project': project, 'id': w.note_id(project), 'before': w.note_id(project)
+    }).status_code
+
+
+@persisted
+def delete_note(w, i):
+    project = w.project()
+    return w.client.post('/delete_note', json={'project': project, 'id': w.note_id(project)}).status_code
+
+
+@persisted
+def batch_recategorize(w, i):
+    """Moves 200 notes into another category in one /batch request."""
+    project = w.project()
+    with w.app.projects_lock:
+        notes = w.app.projects_state[project]['notes']
+        ids = [n['id'] for n in w.rng.sample(notes, min(200, len(notes)))]
+    category = w.rng.choice(['Quellen', 'Zitate', 'Thema: ' + w.keywords(1)[0]])
+    return w.client.post('/batch', json={
+        'project': project, 'ops': [{'op': 'edit_note', 'id': note_id, 'category': category} for note_id in ids]
+    }).status_code
+
+
+@persisted
+def patch_mindmap(w, i):
+    return w.client.patch(f"/projects/{w.project()}", json=[
+        {'op': 'replace', 'path': '/mindmap/0/title', 'value': ' '.join(w.keywords())}
+    ]).status_code
+
+
+@persisted
+def auto_group(w, i):
+    return w.client.post('/auto_group', json={'project': w.project()}).status_code
+
+
+def export(w, i):
+    response = w.client.get(f"/export/{w.project()}")
+    response.get_data()
+    return response.status_code
+
+
+SCENARIOS = {
+    'projects': get_projects,
+    'project': get_project,
+    'notes_page': notes_page,
+    'search': search,
+    'search_stream': search_stream,
+    'note_search': note_search,
+    'proxy': proxy,
+    'proxy_reader': proxy_reader,
+    'stream': stream_connect,
+    'add_note': add_note,
+    'edit_note': edit_note,
+    'move_note': move_note,
+    'delete_note': delete_note,
+    'batch': batch_recategorize,
+    'patch_mindmap': patch_mindmap,
+    'auto_group': auto_group,
+    'export': export,
+}
+
+
+def run_scenario(name, fn, workload, requests, concurrency):
+    def one(i):
+        started = time.perf_counter()
+        try:
+            status = fn(workload, i)
+        except Exception:
+            status = None
+        return time.perf_counter() - started, status
+
+    with RssSampler() as rss:
+        started = time.perf_counter()
+        with concurrent.futures.ThreadPoolExecutor(concurrency) as pool:
+            results = list(pool.map(one, range(requests)))
+        elapsed = time.perf_counter() - started
+
+    latencies = sorted(r[0] * 1000 for r in results)
+    ms = lambda v: round(v, 2) if v is not None else None  # noqa: E731
+    mb = lambda v: round(v, 1) if v is not None else None  # noqa: E731
+    return {
+        'scenario': name,
+        'requests': requests,
+        'errors': sum(1 for _, status in results if status is None or status >= 400),
+        'seconds': round(elapsed, 3),
+        'throughput_rps': round(requests / elapsed, 1),
+        'p50_ms': ms(percentile(latencies, 50)),
+        'p95_ms': ms(percentile(latencies, 95)),
+        'p99_ms': ms(percentile(latencies, 99)),
+        'max_ms': ms(latencies[-1] if latencies else None),
+        'peak_rss_mb': mb(rss.peak),
+        'rss_growth_mb': mb(rss.after - rss.before) if rss.after is not None else None,
+    }
+
+
+def wait_for_crawl(app_module, names, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        progress = [app_module.crawler.progress(name) for name in names]
+        if all(p['queued'] + p['running'] == 0 for p in progress) and any(sum(p.values()) for p in progress):
+            return True
+        time.sleep(0.1)
+    return False
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--projects', type=int, default=3)
+    parser.add_argument('--urls', type=int, default=20)
+    parser.add_argument('--notes', type=int, default=2000)
+    parser.add_argument('--requests', type=int, default=200, help='requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=20, help='fake web latency in ms')
+    parser.add_argument('--jitter', type=float, default=10, help='fake web jitter in ms')
+    parser.add_argument('--size', type=int, default=50, help='fake page size in KB')
+    parser.add_argument('--fail-rate', type=float, default=0.0)
+    parser.add_argument('--pages', help='serve saved HTML pages from this directory')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help='comma separated subset of: ' + ', '.join(SCENARIOS))
+    parser.add_argument('--crawl-timeout', type=float, default=60, help='max seconds to wait for the pre-fetch')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--keep', action='store_true', help='keep the scratch data folder')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    parser.add_argument('--out', help='also write the JSON results to this file')
+    args = parser.parse_args()
+
+    scenarios = [s.strip() for s in args.scenarios.split(',') if s.strip()]
+    unknown = [s for s in scenarios if s not in SCENARIOS]
+    if unknown:
+        sys.exit(f"Unknown scenarios: {', '.join(unknown)}")
+
+    # Resolve paths before switching to the scratch folder
+    args.out = args.out and os.path.abspath(args.out)
+    args.pages = args.pages and os.path.abspath(args.pages)
+
+    base_url = f"http://127.0.0.1:{args.port}"
+    server = start_server(args.port, args.latency, args.jitter, args.size, args.fail_rate, args.pages)
+
+    workdir = tempfile.mkdtemp(prefix='l8te-bench-')
+    os.makedirs(os.path.join(workdir, 'data'))
+    with open(os.path.join(workdir, 'data', 'projects.json'), 'w') as f:
+        json.dump(generate(args.projects, args.urls, args.notes, base_url, args.seed), f)
+
+    # app.py logs to stdout; with --json that has to carry the report alone
+    report_out = sys.stdout
+    if args.json:
+        sys.stdout = sys.stderr
+
+    # app.py resolves its data folders relative to the working directory
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_DIR)
+    started = time.perf_counter()
+    import app as app_module
+    startup = time.perf_counter() - started
+
+    try:
+        workload = Workload(app_module, args.seed)
+        started = time.perf_counter()
+        # The app's own refresh only starts with its first request, after CRAWL_START_DELAY
+        app_module.crawler.refresh_stale()
+        crawled = wait_for_crawl(app_module, workload.names, args.crawl_timeout)
+        warmup = time.perf_counter() - started
+
+        results = []
+        for name in scenarios:
+            results.append(run_scenario(name, SCENARIOS[name], workload, args.requests, args.concurrency))
+            if not args.json:
+                r = results[-1]
+                print(f"{r['scenario']:<14} {r['requests']:>6} req  {r['errors']:>4} err  "
+                      f"{r['throughput_rps']:>8} req/s  p50 {r['p50_ms']:>8} ms  p95 {r['p95_ms']:>8} ms  "
+                      f"p99 {r['p99_ms']:>8} ms  rss {r['peak_rss_mb']} MB (growth {r['rss_growth_mb']} MB)")
+
+        report = {
+            'meta': {
+                'revision': git_revision(),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'startup_seconds': round(startup, 3),
+                'prefetch_seconds': round(warmup, 3),
+                'prefetch_complete': crawled,
+                'params': {k: v for k, v in vars(args).items() if k not in ('json', 'out', 'keep')},
+            },
+            'results': results,
+        }
+        if args.json:
+            print(json.dumps(report, indent=2), file=report_out)
+        if args.out:
+            with open(args.out, 'w') as f:
+                json.dump(report, f, indent=2)
+    finally:
+        server.shutdown()
+        # Write everything now; the app's atexit hooks would run after the
+        # scratch folder is gone
+        app_module.flush_projects()
+        app_module.save_page_cache_index()
+        atexit.unregister(app_module.flush_projects)
+        atexit.unregister(app_module.save_page_cache_index)
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
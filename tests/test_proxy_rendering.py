@@ -0,0 +1,33 @@
+"""Regression tests for the keyword highlighting in rewrite_html."""
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# app keeps its data relative to the working directory; leave the repo's alone
+os.chdir(tempfile.mkdtemp(prefix='l8te-test-'))
+os.makedirs('data')
+
+import app  # noqa: E402
+
+MARK = '<mark class="custom-highlight">{}</mark>'
+
+
+def test_gt_in_quoted_attribute_does_not_end_tag():
+    html = '<p><a title="a>b keyword" href=\'/x?q=>keyword\'>keyword</a></p>'
+    result = app.rewrite_html(html, ['keyword'], 'https://example.org')
+    assert result == ('<p><a title="a>b keyword" href=\'https://example.org/x?q=>keyword\'>'
+                      + MARK.format('keyword') + '</a></p>')
+
+
+def test_unquoted_attribute_with_quote_character():
+    html = "<a title=don't>keyword</a>"
+    result = app.rewrite_html(html, ['keyword'], 'https://example.org')
+    assert result == "<a title=don't>" + MARK.format('keyword') + '</a>'
+
+
+def test_character_references_are_not_split():
+    html = '<p>Tom &amp; Jerry &#169; amp &nbsp;</p>'
+    result = app.rewrite_html(html, ['amp', 'nbsp', '169'], 'https://example.org')
+    assert result == '<p>Tom &amp; Jerry &#169; ' + MARK.format('amp') + ' &nbsp;</p>'